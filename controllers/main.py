@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import werkzeug.urls
+
+from odoo import http
+from odoo.http import request, Response
+
+
+class OnlineSyncController(http.Controller):
+
+    @http.route('/account_online_synchronization/notification', type='http', auth='public', methods=['POST'], csrf=False)
+    def notification(self, **kwargs):
+        ''' Notification of the Odoo Fin proxy telling that new transactions are available, see _receive_push_notification. '''
+        try:
+            body = json.loads(request.httprequest.get_data(as_text=True) or '{}')
+        except ValueError:
+            return Response(status=400)
+        job = request.env['account.online.link'].sudo()._receive_push_notification(
+            request.httprequest.headers,
+            request.httprequest.path,
+            werkzeug.urls.url_decode(request.httprequest.query_string),
+            body,
+        )
+        if job is False:
+            return Response(status=403)
+        return Response(json.dumps({'status': 'ok'}), content_type='application/json')
@@ -3,4 +3,10 @@
 from . import account_bank_statement
 from . import account_journal
 from . import account_online
+from . import account_online_balance
+from . import account_online_notification
+from . import account_online_sync_job
+from . import account_online_sync_run
+from . import account_online_rate_limit
+from . import account_reconciliation_widget
 from . import company
@@ -1,12 +1,25 @@
 # -*- coding: utf-8 -*-
 
+import logging
+import re
+
+import psycopg2
+from dateutil.relativedelta import relativedelta
+
 from odoo import api, fields, models, _
-from odoo.tools import float_is_zero, date_utils
+from odoo.exceptions import UserError
+from odoo.tools import float_is_zero, date_utils, split_every, str2bool
 from odoo.tools.misc import format_date
+from odoo.addons.account_online_synchronization.models import sync_tracing
+
+_logger = logging.getLogger(__name__)
 
 class AccountBankStatement(models.Model):
     _inherit = "account.bank.statement"
 
+    online_sync_to_post = fields.Boolean(readonly=True, index=True, copy=False,
+        help="Technical field set on the statements created by the online synchronization that are waiting to be posted")
+
     def button_validate(self):
         super(AccountBankStatement, self).button_validate()
         for statement in self:
@@ -33,163 +46,319 @@ class AccountBankStatement(models.Model):
              }, ...]
          :param online_account: The online account for this statement
          Return: The number of imported transaction for the journal
+
+         The transactions go through the following stages, each one receiving the whole batch so that it can be
+         extended with set-based work instead of per line work:
+             _online_sync_normalize_transactions: parse the transactions of the proxy into statement line values
+             _online_sync_dedupe_transactions: drop the transactions already imported in the journal
+             _online_sync_enrich_transactions: complete the values of the lines, e.g. with their partner
+             _online_sync_group_transactions: split the lines by statement
+             _online_sync_persist_transactions: create the lines in the existing or new statements
+             _online_sync_post_transactions: post the statements of the created lines
         """
         line_to_reconcile = self.env['account.bank.statement.line']
+        transactions = self._online_sync_normalize_transactions(transactions, online_account)
         for journal in online_account.journal_ids:
             # Since the synchronization succeeded, set it as the bank_statements_source of the journal
             journal.sudo().write({'bank_statements_source': 'online_sync'})
             if not transactions:
                 continue
 
-            transactions_identifiers = [line['online_transaction_identifier'] for line in transactions]
-            existing_transactions_ids = self.env['account.bank.statement.line'].search([('online_transaction_identifier', 'in', transactions_identifiers), ('journal_id', '=', journal.id)])
-            existing_transactions = [t.online_transaction_identifier for t in existing_transactions_ids]
-
-            transactions_partner_information = []
-            for transaction in transactions:
-                transaction['date'] = fields.Date.from_string(transaction['date'])
-                if transaction.get('online_partner_information'):
-                    transactions_partner_information.append(transaction['online_partner_information'])
-
-            if transactions_partner_information:
-                self._cr.execute("""
-                    SELECT p.online_partner_information, p.id FROM res_partner p
-                    WHERE p.online_partner_information IN %s
-                """, [tuple(transactions_partner_information)])
-                partner_id_per_information = dict(self._cr.fetchall())
-            else:
-                partner_id_per_information = {}
+            with sync_tracing.phase('dedupe'):
+                new_transactions = self._online_sync_dedupe_transactions(transactions, journal)
+            new_transactions = self._online_sync_enrich_transactions(new_transactions, journal)
+            max_date = transactions[-1]['date']
+            grouped_transactions = self._online_sync_group_transactions(new_transactions, journal, max_date)
 
-            sorted_transactions = sorted(transactions, key=lambda l: l['date'])
-            min_date = date_utils.start_of(sorted_transactions[0]['date'], 'month')
-            if journal.bank_statement_creation_groupby == 'week':
-                # key is not always the first of month
-                weekday = min_date.weekday()
-                min_date = date_utils.subtract(min_date, days=weekday)
-            max_date = sorted_transactions[-1]['date']
-            total = sum([t['amount'] for t in sorted_transactions])
+            # For first synchronization, an opening bank statement is created to fill the missing bank statements
+            stmt_lines = self._online_sync_create_opening_statement(transactions, journal).line_ids
+            stmt_lines += self._online_sync_persist_transactions(grouped_transactions, journal)
+            self._online_sync_post_transactions(stmt_lines, journal)
+            line_to_reconcile += stmt_lines
 
-            statements_in_range = self.search([('date', '>=', min_date), ('journal_id', '=', journal.id)])
+            # write account balance on the last statement of the journal
+            # That way if there are missing transactions, it will show in the last statement
+            # and the day missing transactions are fetched or manually written, everything will be corrected
+            last_bnk_stmt = self.search([('journal_id', '=', journal.id)], limit=1)
+            if last_bnk_stmt and new_transactions:
+                last_bnk_stmt.balance_end_real = online_account.balance
+            # Set last sync date as the last transaction date
+            journal.account_online_account_id.sudo().write({'last_sync': max_date})
+        line_to_reconcile._online_sync_schedule_matching()
+        return line_to_reconcile
 
-            # For first synchronization, an opening bank statement is created to fill the missing bank statements
-            all_statement = self.search_count([('journal_id', '=', journal.id)])
-            digits_rounding_precision = journal.currency_id.rounding if journal.currency_id else journal.company_id.currency_id.rounding
-            # If there are neither statement and the ending balance != 0, we create an opening bank statement
-            if all_statement == 0 and not float_is_zero(online_account.balance - total, precision_rounding=digits_rounding_precision):
-                opening_transaction = [(0, 0, {
-                    'date': date_utils.subtract(min_date, days=1),
-                    'payment_ref': _("Opening statement: first synchronization"),
-                    'amount': online_account.balance - total,
-                })]
-                op_stmt = self.create({
-                    'date': date_utils.subtract(min_date, days=1),
-                    'line_ids': opening_transaction,
-                    'journal_id': journal.id,
-                    'balance_end_real': online_account.balance - total,
-                })
-                op_stmt.button_post()
-                line_to_reconcile += op_stmt.mapped('line_ids')
-
-            transactions_in_statements = []
-            statement_to_recompute = self.env['account.bank.statement']
-            transactions_to_create = {}
-
-            for transaction in sorted_transactions:
-                if transaction['online_transaction_identifier'] in existing_transactions:
-                    continue # Do nothing if the transaction already exists
-                line = transaction.copy()
-                line['online_account_id'] = online_account.id
-                if journal.bank_statement_creation_groupby == 'day':
-                    # key is full date
-                    key = transaction['date']
-                elif journal.bank_statement_creation_groupby == 'week':
-                    # key is first day of the week
-                    weekday = transaction['date'].weekday()
-                    key = date_utils.subtract(transaction['date'], days=weekday)
-                elif journal.bank_statement_creation_groupby == 'bimonthly':
-                    if transaction['date'].day >= 15:
-                        # key is the 15 of that month
-                        key = transaction['date'].replace(day=15)
-                    else:
-                        # key if the first of the month
-                        key = date_utils.start_of(transaction['date'], 'month')
-                    # key is year-month-0 or year-month-1
-                elif journal.bank_statement_creation_groupby == 'month':
-                    # key is first of the month
-                    key = date_utils.start_of(transaction['date'], 'month')
+    @api.model
+    def _online_sync_normalize_transactions(self, transactions, online_account):
+        '''
+        Hook turning the transactions sent by the proxy into the values of the statement lines to create.
+        :param transactions: The transactions sent by the proxy for the online account.
+        :param online_account: The synchronized account.online.account.
+        :return: The values of the statement lines, sorted by date.
+        '''
+        batch = self.env.context.get('online_sync_batch')
+        lines = [dict(
+            transaction,
+            date=fields.Date.from_string(transaction['date']),
+            online_account_id=online_account.id,
+            online_sync_batch=batch,
+        ) for transaction in transactions]
+        return sorted(lines, key=lambda l: l['date'])
+
+    @api.model
+    def _online_sync_dedupe_transactions(self, transactions, journal):
+        '''
+        Hook dropping the transactions already imported in the journal.
+        :param transactions: The values of the statement lines, as given by _online_sync_normalize_transactions.
+        :param journal: The account.journal the lines are imported in.
+        :return: Copies of the values of the lines to import, which the next stages can change.
+        '''
+        transactions_identifiers = [line['online_transaction_identifier'] for line in transactions]
+        existing_transactions_ids = self.env['account.bank.statement.line'].search([('online_transaction_identifier', 'in', transactions_identifiers), ('journal_id', '=', journal.id)])
+        existing_transactions = set(existing_transactions_ids.mapped('online_transaction_identifier'))
+        return [dict(line) for line in transactions if line['online_transaction_identifier'] not in existing_transactions]
+
+    @api.model
+    def _online_sync_enrich_transactions(self, transactions, journal):
+        '''
+        Hook completing the values of the lines to import, by default with their partner: the one known for
+        the online_partner_information sent by the provider, or else the one suggested from the label. The
+        suggestion is kept on the line, and only set as its partner when its confidence is high enough.
+        :param transactions: The values of the lines to import, as given by _online_sync_dedupe_transactions.
+        :param journal: The account.journal the lines are imported in.
+        :return: The values of the lines.
+        '''
+        transactions_partner_information = [line['online_partner_information'] for line in transactions if line.get('online_partner_information')]
+        if transactions_partner_information:
+            self._cr.execute("""
+                SELECT p.online_partner_information, p.id FROM res_partner p
+                WHERE p.online_partner_information IN %s
+            """, [tuple(transactions_partner_information)])
+            partner_id_per_information = dict(self._cr.fetchall())
+        else:
+            partner_id_per_information = {}
+        # Suggest a partner for the lines the provider did not give one, once for the whole batch
+        partner_suggestions = self.env['res.partner']._suggest_online_sync_partners([
+            line for line in transactions if not line.get('partner_id') and not line.get('online_partner_information')
+        ], journal.account_online_account_id.company_id)
+        auto_assign_threshold = float(self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.partner_auto_assign_threshold', 1.0))
+
+        for line in transactions:
+            if line.get('online_partner_information'):
+                partner_info = line['online_partner_information']
+                if partner_id_per_information.get(partner_info):
+                    line['partner_id'] = partner_id_per_information[partner_info]
+            elif not line.get('partner_id') and line['online_transaction_identifier'] in partner_suggestions:
+                partner_id, confidence = partner_suggestions[line['online_transaction_identifier']]
+                line['online_partner_suggestion_id'], line['online_partner_confidence'] = partner_id, confidence
+                if confidence >= auto_assign_threshold:
+                    line['partner_id'] = partner_id
+        return transactions
+
+    @api.model
+    def _online_sync_group_transactions(self, transactions, journal, max_date):
+        '''
+        Hook splitting the lines to import by statement, according to the bank_statement_creation_groupby of the journal.
+        :param transactions: The values of the lines to import, as given by _online_sync_enrich_transactions.
+        :param journal: The account.journal the lines are imported in.
+        :param max_date: The date of the last transaction sent by the proxy, used when the lines are not grouped by period.
+        :return: A dict giving the values of the lines by date of their statement, in chronological order.
+        '''
+        grouped_transactions = {}
+        for line in transactions:
+            if journal.bank_statement_creation_groupby == 'day':
+                # key is full date
+                key = line['date']
+            elif journal.bank_statement_creation_groupby == 'week':
+                # key is first day of the week
+                weekday = line['date'].weekday()
+                key = date_utils.subtract(line['date'], days=weekday)
+            elif journal.bank_statement_creation_groupby == 'bimonthly':
+                if line['date'].day >= 15:
+                    # key is the 15 of that month
+                    key = line['date'].replace(day=15)
                 else:
-                    # key is last date of transactions fetched
-                    key = max_date
+                    # key if the first of the month
+                    key = date_utils.start_of(line['date'], 'month')
+                # key is year-month-0 or year-month-1
+            elif journal.bank_statement_creation_groupby == 'month':
+                # key is first of the month
+                key = date_utils.start_of(line['date'], 'month')
+            else:
+                # key is last date of transactions fetched
+                key = max_date
+            grouped_transactions.setdefault(key, []).append(line)
+        return grouped_transactions
+
+    @api.model
+    def _online_sync_create_opening_statement(self, transactions, journal):
+        '''
+        Create the statement filling the gap between the balance of the online account and the transactions
+        fetched by its first synchronization.
+        :return: The created statement, if any.
+        '''
+        online_account = journal.account_online_account_id
+        # If there are neither statement and the ending balance != 0, we create an opening bank statement
+        if self.search_count([('journal_id', '=', journal.id)]):
+            return self.browse()
+        total = sum([t['amount'] for t in transactions])
+        digits_rounding_precision = journal.currency_id.rounding if journal.currency_id else journal.company_id.currency_id.rounding
+        if float_is_zero(online_account.balance - total, precision_rounding=digits_rounding_precision):
+            return self.browse()
+        min_date = date_utils.start_of(transactions[0]['date'], 'month')
+        if journal.bank_statement_creation_groupby == 'week':
+            # key is not always the first of month
+            weekday = min_date.weekday()
+            min_date = date_utils.subtract(min_date, days=weekday)
+        opening_transaction = [(0, 0, {
+            'date': date_utils.subtract(min_date, days=1),
+            'payment_ref': _("Opening statement: first synchronization"),
+            'amount': online_account.balance - total,
+            'online_sync_batch': self.env.context.get('online_sync_batch'),
+        })]
+        return self.create({
+            'date': date_utils.subtract(min_date, days=1),
+            'line_ids': opening_transaction,
+            'journal_id': journal.id,
+            'balance_end_real': online_account.balance - total,
+        })
 
-                # Find partner id if exists
-                if line.get('online_partner_information'):
-                    partner_info = line['online_partner_information']
-                    if partner_id_per_information.get(partner_info):
-                        line['partner_id'] = partner_id_per_information[partner_info]
+    @api.model
+    def _online_sync_persist_transactions(self, grouped_transactions, journal):
+        '''
+        Hook creating the lines to import, in the existing statement of their date or in new statements.
+        Once a statement has reached the bank_statement_max_lines of the journal, the next lines of its
+        period go to a continuation statement.
+        :param grouped_transactions: The values of the lines by date of their statement, as given by _online_sync_group_transactions.
+        :param journal: The account.journal the lines are imported in.
+        :return: The created account.bank.statement.line.
+        '''
+        if not grouped_transactions:
+            return self.env['account.bank.statement.line']
+        statements_in_range = self.search([('date', 'in', list(grouped_transactions)), ('journal_id', '=', journal.id)])
+        max_lines = journal.bank_statement_max_lines
+        if max_lines and statements_in_range:
+            statement_line_count = {
+                group['statement_id'][0]: group['statement_id_count']
+                for group in self.env['account.bank.statement.line'].read_group(
+                    [('statement_id', 'in', statements_in_range.ids)], ['statement_id'], ['statement_id'])
+            }
+        else:
+            statement_line_count = {}
 
+        transactions_in_statements = []
+        statement_to_recompute = self.env['account.bank.statement']
+        transactions_to_create = {}
+        for key, lines in grouped_transactions.items():
+            statements_of_key = statements_in_range.filtered(lambda x: x.date == key)
+            for line in lines:
                 # Decide if we have to update an existing statement or create a new one with this line
-                stmt = statements_in_range.filtered(lambda x: x.date == key)
+                stmt = statements_of_key
+                if max_lines:
+                    stmt = stmt.filtered(lambda x: statement_line_count.get(x.id, 0) < max_lines)
                 if stmt:
+                    statement_line_count[stmt[0].id] = statement_line_count.get(stmt[0].id, 0) + 1
                     line['statement_id'] = stmt[0].id
                     transactions_in_statements.append(line)
                     statement_to_recompute += stmt[0]
                 else:
-                    if not transactions_to_create.get(key):
-                        transactions_to_create[key] = []
-                    transactions_to_create[key].append((0, 0, line))
-
-            # Create the lines that should be inside an existing bank statement and reset those stmt in draft
-            if transactions_in_statements:
-                statement_to_recompute.write({'state': 'open'})
-                line_to_reconcile += self.env['account.bank.statement.line'].create(transactions_in_statements)
-                # Recompute the balance_end_real of the first statement where we added line
-                # because adding line don't trigger a recompute and balance_end_real is not updated.
-                # We only trigger the recompute on the first element of the list as it is the one
-                # the most in the past and this will trigger the recompute of all the statements
-                # that are next.
-                statement_to_recompute[0]._compute_ending_balance()
-                # Since the balance end real of the latest statement is not recomputed, we will
-                # have a problem as balance_end_real and computed balance won't be the same and therefore
-                # we will have an error while trying to post the entries. To prevent that error,
-                # we force the balance_end_real of the latest statement to be the same as the computed
-                # balance. Balance_end_real will be changed at the end of this method to match
-                # the real balance of the account anyway so this is no big deal.
-                statement_to_recompute[-1].balance_end_real = statement_to_recompute[-1].balance_end
-                # Post the statement back
-                statement_to_recompute.button_post()
-
-            # Create lines inside new bank statements
-            created_stmts = self.env['account.bank.statement']
-            for date, lines in transactions_to_create.items():
-                # balance_start and balance_end_real will be computed automatically
-                if journal.bank_statement_creation_groupby in ('bimonthly', 'week', 'month'):
-                    end_date = date
-                    if journal.bank_statement_creation_groupby == 'month':
-                        end_date = date_utils.end_of(date, 'month')
-                    elif journal.bank_statement_creation_groupby == 'week':
-                        end_date = date_utils.add(date, days=6)
-                    elif journal.bank_statement_creation_groupby == 'bimonthly':
-                        if end_date.day == 1:
-                            end_date = date.replace(day=14)
-                        else:
-                            end_date = date_utils.end_of(date, 'month')
-                created_stmts += self.env['account.bank.statement'].create({
-                    'date': date,
-                    'line_ids': lines,
-                    'journal_id': journal.id,
-                })
-
-            created_stmts.button_post()
-            line_to_reconcile += created_stmts.mapped('line_ids')
-            # write account balance on the last statement of the journal
-            # That way if there are missing transactions, it will show in the last statement
-            # and the day missing transactions are fetched or manually written, everything will be corrected
-            last_bnk_stmt = self.search([('journal_id', '=', journal.id)], limit=1)
-            if last_bnk_stmt and (created_stmts or transactions_in_statements):
-                last_bnk_stmt.balance_end_real = online_account.balance
-            # Set last sync date as the last transaction date
-            journal.account_online_account_id.sudo().write({'last_sync': max_date})
-        return line_to_reconcile
+                    transactions_to_create.setdefault(key, []).append((0, 0, line))
+
+        created_lines = self.env['account.bank.statement.line']
+        # Create the lines that should be inside an existing bank statement and reset those stmt in draft
+        if transactions_in_statements:
+            statement_to_recompute.write({'state': 'open'})
+            created_lines += self.env['account.bank.statement.line'].create(transactions_in_statements)
+            # Recompute the balance_end_real of the first statement where we added line
+            # because adding line don't trigger a recompute and balance_end_real is not updated.
+            # We only trigger the recompute on the first element of the list as it is the one
+            # the most in the past and this will trigger the recompute of all the statements
+            # that are next.
+            statement_to_recompute[0]._compute_ending_balance()
+            # Since the balance end real of the latest statement is not recomputed, we will
+            # have a problem as balance_end_real and computed balance won't be the same and therefore
+            # we will have an error while trying to post the entries. To prevent that error,
+            # we force the balance_end_real of the latest statement to be the same as the computed
+            # balance. Balance_end_real will be changed at the end of this method to match
+            # the real balance of the account anyway so this is no big deal.
+            statement_to_recompute[-1].balance_end_real = statement_to_recompute[-1].balance_end
+
+        # Create lines inside new bank statements
+        created_stmts = self.env['account.bank.statement']
+        for date, lines in transactions_to_create.items():
+            # balance_start and balance_end_real will be computed automatically
+            # The continuation statements are created in order, so that their balances are chained by id
+            created_stmts += self.env['account.bank.statement'].create([{
+                'date': date,
+                'line_ids': list(statement_lines),
+                'journal_id': journal.id,
+            } for statement_lines in (split_every(max_lines, lines) if max_lines else [lines])])
+        return created_lines + created_stmts.mapped('line_ids')
+
+    @api.model
+    def _online_sync_post_transactions(self, stmt_lines, journal):
+        '''
+        Hook posting the statements of the imported lines, see _online_sync_post.
+        :param stmt_lines: The account.bank.statement.line created by the synchronization in the journal.
+        :param journal: The account.journal the lines are imported in.
+        '''
+        stmt_lines.mapped('statement_id')._online_sync_post()
+
+    def _online_sync_post(self):
+        '''
+        Post the statements created or updated by the synchronization. With the deferred posting, the statements
+        are left open and posted later by batch, taking the generation of the journal entries out of the synchronization.
+        '''
+        if not self:
+            return
+        if str2bool(self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.deferred_posting', 'False')):
+            self.write({'online_sync_to_post': True})
+            self.env.ref('account_online_synchronization.online_sync_posting_cron').sudo()._trigger()
+        else:
+            with sync_tracing.phase('posting'):
+                self.button_post()
+
+    def _online_sync_post_deferred(self):
+        # The balance_end_real of the last statement is set to the balance of the online account after the
+        # synchronization, while it used to be posted with the computed balance. Post it the same way.
+        for statement in self.sorted(lambda s: (s.date, s.id)):
+            if statement.state == 'open':
+                balance_end_real = statement.balance_end_real
+                statement.balance_end_real = statement.balance_end
+                statement.button_post()
+                statement.balance_end_real = balance_end_real
+        self.write({'online_sync_to_post': False})
+
+    @api.model
+    def _cron_post_online_sync_statements(self):
+        batch_size = int(self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.posting_batch_size', 50))
+        statements = self.search([('online_sync_to_post', '=', True)], order='date, id')
+        # The journal may not be synchronized anymore
+        statements.filtered(lambda s: not s.journal_id.account_online_link_id)._online_sync_post_batches(batch_size)
+        for link in statements.mapped('journal_id.account_online_link_id'):
+            # Do not post statements that a synchronization of the link is updating, retry later
+            with link._lock_synchronization() as locked:
+                if not locked:
+                    self.env.ref('account_online_synchronization.online_sync_posting_cron')._trigger(fields.Datetime.now() + relativedelta(minutes=5))
+                    continue
+                statements.filtered(lambda s: s.journal_id.account_online_link_id == link)._online_sync_post_batches(batch_size)
+        # The lines of the posted statements can now be matched
+        self.env['account.bank.statement.line']._online_sync_trigger_matching()
+
+    def _online_sync_post_batches(self, batch_size):
+        for batch in split_every(batch_size, self.ids, self.browse):
+            try:
+                with self.env.cr.savepoint():
+                    batch._online_sync_post_deferred()
+            except UserError:
+                # Post what can be posted and leave the others open for the user
+                for statement in batch:
+                    try:
+                        with self.env.cr.savepoint():
+                            statement._online_sync_post_deferred()
+                    except UserError as e:
+                        _logger.warning('Online sync: could not post the statement %s: %s', statement.id, e)
+                        statement.online_sync_to_post = False
+            self.env.cr.commit()
 
 
 class AccountBankStatementLine(models.Model):
@@ -199,9 +368,173 @@ class AccountBankStatementLine(models.Model):
     online_partner_information = fields.Char(readonly=True)
     online_account_id = fields.Many2one(comodel_name='account.online.account', readonly=True)
     online_link_id = fields.Many2one(comodel_name='account.online.link', related='online_account_id.account_online_link_id', store=True, readonly=True)
+    online_sync_batch = fields.Char(readonly=True, index=True, copy=False,
+        help="Technical field identifying the synchronization that created the line")
+    online_partner_suggestion_id = fields.Many2one('res.partner', string="Suggested Partner", readonly=True, copy=False,
+        help="Partner suggested by the synchronization from the label of the transaction, only set as the partner of the line above the auto-assign threshold")
+    online_partner_confidence = fields.Float("Partner Confidence", readonly=True, copy=False,
+        help="Confidence of the partner suggested by the synchronization from the label of the transaction, from 0 to 1")
+
+    # Reconciliation propositions computed in the background after the synchronization, see _cron_precompute_online_sync_matching
+    online_sync_to_match = fields.Boolean(readonly=True, index=True, copy=False,
+        help="Technical field set on the synchronized lines waiting for their reconciliation propositions to be computed")
+    online_match_status = fields.Selection([
+        ('none', 'No Proposition'),
+        ('proposition', 'Proposition'),
+        ('write_off', 'Write-off'),
+    ], readonly=True, copy=False)
+    online_match_aml_ids = fields.Many2many('account.move.line', 'account_online_match_move_line_rel', 'statement_line_id', 'move_line_id',
+        string="Precomputed Propositions", readonly=True, copy=False)
+    online_match_model_id = fields.Many2one('account.reconcile.model', readonly=True, copy=False, ondelete='set null')
+    online_match_partner_id = fields.Many2one('res.partner', readonly=True, copy=False, ondelete='set null',
+        help="Technical field holding the partner the propositions have been computed for")
+
+    def _use_online_sync_matching(self):
+        return str2bool(self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.precompute_matching', 'False'))
+
+    def _online_sync_schedule_matching(self):
+        ''' Compute the reconciliation propositions of the synchronized lines in the background, when enabled. '''
+        if not self or not self._use_online_sync_matching():
+            return
+        self.write({'online_sync_to_match': True})
+        self._online_sync_trigger_matching()
+
+    @api.model
+    def _online_sync_trigger_matching(self):
+        if self._use_online_sync_matching():
+            self.env.ref('account_online_synchronization.online_sync_matching_cron').sudo()._trigger()
+
+    @api.model
+    def _cron_precompute_online_sync_matching(self):
+        '''
+        Apply the reconciliation models on the synchronized lines by batch, as the reconciliation widget would do when
+        opening them, and keep the result so that the widget can open right away (see account.reconcile.model _apply_rules).
+        The lines of the statements that are not posted yet are left for a later run.
+        '''
+        batch_size = int(self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.matching_batch_size', 200))
+        lines = self.search([('online_sync_to_match', '=', True), ('statement_id.state', '=', 'posted')], order='id')
+        for company in lines.mapped('company_id'):
+            reconcile_models = self.env['account.reconcile.model'].search([
+                ('rule_type', '!=', 'writeoff_button'),
+                ('company_id', '=', company.id),
+            ])
+            for batch in split_every(batch_size, lines.filtered(lambda l: l.company_id == company).ids, self.browse):
+                batch._online_sync_precompute_matching(reconcile_models)
+                self.env.cr.commit()
+
+    def _online_sync_precompute_matching(self, reconcile_models):
+        to_match = self.filtered(lambda l: not l.is_reconciled)
+        # Find the partners the same way as the reconciliation widget, so that the propositions are the ones it would compute
+        partner_map = self.env['account.reconciliation.widget']._get_bank_statement_line_partners(to_match) if to_match else {}
+        matching = reconcile_models._apply_rules(to_match, partner_map=partner_map) if reconcile_models and to_match else {}
+        no_proposition = self - to_match
+        for line in to_match:
+            result = matching.get(line.id) or {}
+            if result.get('status') == 'reconciled' or not (result.get('aml_ids') or result.get('model')):
+                no_proposition |= line
+                continue
+            line.write({
+                'online_sync_to_match': False,
+                'online_match_status': 'write_off' if result.get('status') == 'write_off' else 'proposition',
+                'online_match_aml_ids': [(6, 0, result.get('aml_ids') or [])],
+                'online_match_model_id': result['model'].id if result.get('model') else False,
+                'online_match_partner_id': partner_map.get(line.id) or line.partner_id.id,
+            })
+        no_proposition.write({'online_sync_to_match': False, 'online_match_status': 'none'})
+
+    def _is_online_match_valid(self, reconcile_models, excluded_ids=None, partner_map=None):
+        '''
+        Check that the precomputed propositions of the line are still the ones _apply_rules would give.
+        :param reconcile_models: The reconciliation models applied by the widget.
+        :param excluded_ids: The ids of the journal items already proposed for other lines.
+        :param partner_map: The partners found by the widget by statement line id.
+        '''
+        self.ensure_one()
+        if self.online_match_model_id and self.online_match_model_id not in reconcile_models:
+            return False
+        partner_id = (partner_map or {}).get(self.id) or self.partner_id.id
+        if partner_id != self.online_match_partner_id.id:
+            return False
+        excluded_ids = set(excluded_ids or [])
+        return not any(aml.reconciled or aml.id in excluded_ids for aml in self.online_match_aml_ids)
 
 
 class ResPartner(models.Model):
     _inherit = 'res.partner'
 
     online_partner_information = fields.Char(readonly=True)
+
+    def init(self):
+        super(ResPartner, self).init()
+        # Trigram index used to suggest the partners of the synchronized transactions, see _suggest_online_sync_partners
+        try:
+            with self.env.cr.savepoint():
+                self.env.cr.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except psycopg2.Error:
+            _logger.warning("Online sync: the pg_trgm extension could not be installed, no partner will be suggested from the label of the transactions")
+            return
+        self.env.cr.execute("CREATE INDEX IF NOT EXISTS res_partner_name_trgm_index ON res_partner USING gin (lower(name) gin_trgm_ops)")
+
+    @api.model
+    def _has_trigram_index(self):
+        self.env.cr.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return bool(self.env.cr.fetchone())
+
+    @api.model
+    def _suggest_online_sync_partners(self, transactions, company):
+        '''
+        Suggest a partner for the given transactions, matching their label against the names of the partners
+        with trigrams and the numbers it contains against the bank accounts of the partners.
+        All the transactions are matched at once by a single query using the trigram index of the partners.
+        :param transactions: The transactions, as sent by the proxy.
+        :param company: The company of the synchronized journals.
+        :return: A dict giving (partner id, confidence score between 0 and 1) by online_transaction_identifier,
+                 for the transactions matched with a confidence above the configured threshold.
+        '''
+        if not transactions or not self._has_trigram_index():
+            return {}
+        threshold = float(self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.partner_suggestion_threshold', 0.6))
+        keys, labels, token_keys, tokens = [], [], [], []
+        for index, transaction in enumerate(transactions):
+            label = transaction.get('payment_ref') or transaction.get('name') or ''
+            # The names of the partners rarely contain digits, while the labels are full of dates and references
+            normalized = ' '.join(re.sub(r'[\W\d_]+', ' ', label.lower()).split())
+            if len(normalized) >= 3:
+                keys.append(index)
+                labels.append(normalized)
+            for token in set(re.findall(r'[A-Z0-9]{6,}', re.sub(r'[^\w ]+', '', label.upper()))):
+                token_keys.append(index)
+                tokens.append(token)
+        if not keys and not tokens:
+            return {}
+
+        self.flush(['name', 'active', 'company_id'])
+        self.env['res.partner.bank'].flush(['sanitized_acc_number', 'partner_id', 'company_id'])
+        self.env.cr.execute("""
+            WITH candidate AS (
+                SELECT label.key, partner.id AS partner_id, similarity(lower(partner.name), label.value)::float AS score
+                  FROM unnest(%(keys)s::int[], %(labels)s::text[]) AS label(key, value)
+                  JOIN res_partner partner ON lower(partner.name) %% label.value
+                 WHERE partner.active
+                   AND (partner.company_id IS NULL OR partner.company_id = %(company_id)s)
+             UNION ALL
+                SELECT token.key, bank.partner_id, 1.0::float AS score
+                  FROM unnest(%(token_keys)s::int[], %(tokens)s::text[]) AS token(key, value)
+                  JOIN res_partner_bank bank ON bank.sanitized_acc_number = token.value
+                 WHERE bank.company_id IS NULL OR bank.company_id = %(company_id)s
+            )
+            SELECT DISTINCT ON (key) key, partner_id, score
+              FROM candidate
+          ORDER BY key, score DESC, partner_id
+        """, {
+            'keys': keys,
+            'labels': labels,
+            'token_keys': token_keys,
+            'tokens': tokens,
+            'company_id': company.id,
+        })
+        return {
+            transactions[key]['online_transaction_identifier']: (partner_id, score)
+            for key, partner_id, score in self.env.cr.fetchall()
+            if score >= threshold
+        }
@@ -1,7 +1,17 @@
 # -*- coding: utf-8 -*-
 
+import logging
+import time
+from collections import defaultdict
+
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError
+from odoo.tools import config
+from odoo.addons.account_online_synchronization.models import account_online, sync_digest
+from odoo.addons.base.models.ir_cron import _intervalTypes
+
+_logger = logging.getLogger(__name__)
+
 
 class AccountJournal(models.Model):
     _inherit = "account.journal"
@@ -23,20 +33,104 @@ class AccountJournal(models.Model):
                                                     "new transactions from your bank account.",
                                                default='month',
                                                string='Bank Statements Group By')
+    bank_statement_max_lines = fields.Integer("Maximum Lines per Statement", default=0,
+                                              help="When a synchronized bank statement reaches this number of lines, the next transactions "
+                                                   "of the same period are put in a new statement. Leave 0 for no limit.")
 
     @api.model
     def _cron_fetch_online_transactions(self):
-        for journal in self.search([('account_online_account_id', '!=', False)]):
-            if journal.account_online_link_id.auto_sync:
-                journal.with_context(cron=True).manual_sync()
-                # for cron jobs it is usually recommended to commit after each iteration, so that a later error or job timeout doesn't discard previous work
+        journals = self.search([('account_online_account_id', '!=', False)])
+        accounts_by_link = defaultdict(lambda: self.env['account.online.account'])
+        for journal in journals:
+            accounts_by_link[journal.account_online_link_id] |= journal.account_online_account_id
+        # Skip the links waiting for the user and the ones failing until their next retry
+        links = journals.mapped('account_online_link_id').filtered(lambda l: l.auto_sync and l._is_cron_sync_allowed())
+        # Start with the links that have waited the longest, and stop before the worker is killed so that
+        # the next run goes on with the links not attempted yet instead of starting over with the same ones.
+        budget = self._get_online_sync_cron_budget()
+        start = time.time()
+        cycle_start = self._get_online_sync_cron_cycle_start()
+        self.env.cr.commit()
+        # Do not post a message and track the state on the links for every call to the proxy,
+        # write a summary per link once all its accounts are synchronized.
+        digest = sync_digest.SyncDigest()
+        with sync_digest.collecting(digest):
+            stale_links = links._get_sync_staleness_order(attempted_before=cycle_start)
+            for index, (link, estimate) in enumerate(stale_links):
+                if budget and index and time.time() - start + estimate > budget:
+                    _logger.info('Online sync: time budget of the cron exhausted, %s links left for the next run', len(stale_links) - index)
+                    self.env.ref('account_online_synchronization.online_sync_cron')._trigger()
+                    break
+                failed = needs_action = False
+                # Synchronize all the accounts of the link at once, sharing its lock, access token and connection to the proxy
+                accounts = accounts_by_link[link]
+                try:
+                    res = link.with_context(cron=True, dont_show_transactions=True)._fetch_transactions(accounts=accounts)
+                    if res == account_online.SYNC_BUSY:
+                        # Synchronized by someone else right now, who takes care of its digest and backoff
+                        continue
+                    # An action is only returned when the user has to act on the link
+                    needs_action = bool(res)
+                    # for cron jobs it is usually recommended to commit after each iteration, so that a later error or job timeout doesn't discard previous work
+                    self.env.cr.commit()
+                except UserError as e:
+                    # The error is in the digest
+                    _logger.info('Online sync: synchronization of link %s failed: %s', link.id, e)
+                    self.env.cr.rollback()
+                    failed = True
+                except Exception as e:
+                    # An unexpected error must not prevent the other links from being synchronized
+                    _logger.exception('Online sync: synchronization of link %s failed', link.id)
+                    self.env.cr.rollback()
+                    link._log_information(state='error', subject=_('Internal Error'), message=str(e))
+                    failed = True
+                link._flush_sync_digest(digest)
+                link._update_sync_backoff(failed=failed, needs_action=needs_action)
                 self.env.cr.commit()
+            else:
+                # Every link has been attempted, the next run starts a new cycle
+                self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.cron_cycle_start', False)
+
+    @api.model
+    def _get_online_sync_cron_budget(self):
+        '''
+        :return: The number of seconds the cron can spend synchronizing links, 0 if it is not limited.
+        By default, this is most of the real time limit of the cron workers.
+        '''
+        budget = self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.cron_time_budget')
+        if budget:
+            return float(budget)
+        limit = config.get('limit_time_real_cron', -1)
+        if limit is None or limit < 0:
+            limit = config.get('limit_time_real', 0)
+        return limit * 0.8 if limit and limit > 0 else 0
+
+    @api.model
+    def _get_online_sync_cron_cycle_start(self):
+        '''
+        The links left by a run out of time budget are synchronized by the runs it triggers. Together, these runs
+        form a cycle only synchronizing the links not attempted since it started, so that they do not start over
+        with the links just synchronized. A new cycle starts once every link has been attempted, or when the
+        current one started more than an interval of the cron ago.
+        :return: The datetime at which the current cycle started.
+        '''
+        ICP = self.env['ir.config_parameter'].sudo()
+        cron = self.env.ref('account_online_synchronization.online_sync_cron')
+        now = fields.Datetime.now()
+        cycle_start = fields.Datetime.to_datetime(ICP.get_param('account_online_synchronization.cron_cycle_start'))
+        if not cycle_start or cycle_start < now - _intervalTypes[cron.interval_type](cron.interval_number):
+            cycle_start = now
+            ICP.set_param('account_online_synchronization.cron_cycle_start', fields.Datetime.to_string(cycle_start))
+        return cycle_start
 
     def manual_sync(self):
         self.ensure_one()
         if self.account_online_link_id:
             account = self.account_online_account_id
-            return self.account_online_link_id.with_context(dont_show_transactions=True)._fetch_transactions(accounts=account)
+            link = self.account_online_link_id.with_context(dont_show_transactions=True)
+            if link._use_background_sync():
+                return link._fetch_transactions_in_background(accounts=account)
+            return link._fetch_transactions(accounts=account)
 
     def unlink(self):
         '''
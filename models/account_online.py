@@ -1,21 +1,69 @@
 # -*- coding: utf-8 -*-
 
+import base64
+import hmac
+import json
 import requests
 import logging
+import math
 import re
+import threading
+import time
+import uuid
+import zlib
 import odoo
 import odoo.release
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
 from requests.exceptions import RequestException, Timeout, ConnectionError
 from odoo import api, fields, models, _
-from odoo.tools import format_date
+from odoo.tools import format_date, str2bool
 from odoo.exceptions import UserError, CacheMiss, MissingError, ValidationError
+from odoo.addons.account_online_synchronization.models import sync_digest, sync_recording, sync_tracing
 from odoo.addons.account_online_synchronization.models.odoofin_auth import OdooFinAuth
 from odoo.tools.misc import get_lang
 
 _logger = logging.getLogger(__name__)
 pattern = re.compile("^[a-z0-9-_]+$")
+# Durations of the last calls to the proxy by endpoint, see AccountOnlineLink._get_request_timeout
+request_latencies = {}
+request_latencies_lock = threading.Lock()
+LATENCY_WINDOW = 200
+LATENCY_MIN_SAMPLES = 20
+# requests.Session of the link being synchronized by the current thread, see AccountOnlineLink._odoo_fin_session
+odoo_fin_transport = threading.local()
+# First key of the advisory locks taken on the links being synchronized, the second one being the id of the link
+SYNC_LOCK_NAMESPACE = zlib.crc32(b'account.online.link') & 0x7fffffff
+# Returned by AccountOnlineLink._fetch_transactions to the cron when the link is already being synchronized
+SYNC_BUSY = 'busy'
+
+def send_odoo_fin_request(request):
+    '''
+    Send a request prepared by AccountOnlineLink._prepare_odoo_fin_request to the proxy. This does not use the
+    environment, so that it can run in another thread while the current one goes on with its work.
+    :return: A dict with the json response, the duration, the HTTP status and the size of the exchange,
+             or with the exception raised while reaching the proxy.
+    '''
+    if request.get('replayer'):
+        return request['replayer'].send(request)
+    start = time.time()
+    response = {}
+    try:
+        resp = (request.get('session') or requests).post(url=request['endpoint_url'], json=request['data'], timeout=request['timeout'], auth=request['auth'])
+        response.update({
+            'duration': time.time() - start,
+            'status': resp.status_code,
+            'size': len(resp.request.body or b'') + len(resp.content),
+        })
+        response['json'] = resp.json()
+    except (Timeout, ConnectionError, RequestException, ValueError) as e:
+        response.setdefault('duration', time.time() - start)
+        response['exception'] = e
+    return response
+
 
 class AccountOnlineAccount(models.Model):
     _name = 'account.online.account'
@@ -25,11 +73,13 @@ class AccountOnlineAccount(models.Model):
     online_identifier = fields.Char(help='Id used to identify account by third party provider', readonly=True)
     balance = fields.Float(readonly=True, help='Balance of the account sent by the third party provider')
     account_number = fields.Char(help='Set if third party provider has the full account number')
-    account_data = fields.Char(help='Extra information needed by third party provider', readonly=True)
+    # The encrypted blobs are only needed to call the proxy, do not load them with every read of the record
+    account_data = fields.Char(help='Extra information needed by third party provider', readonly=True, prefetch=False)
 
     account_online_link_id = fields.Many2one('account.online.link', readonly=True, ondelete='cascade')
     journal_ids = fields.One2many('account.journal', 'account_online_account_id', string='Journal', domain=[('type', '=', 'bank')])
     last_sync = fields.Date("Last synchronization")
+    balance_history_ids = fields.One2many('account.online.balance', 'account_online_account_id', string='Balance History', readonly=True)
     company_id = fields.Many2one('res.company', related='account_online_link_id.company_id')
 
     @api.constrains('journal_ids')
@@ -48,25 +98,36 @@ class AccountOnlineAccount(models.Model):
 
     def _refresh(self):
         data = {'account_id': self.online_identifier}
-        while True:
-            # While this is kind of a bad practice to do, it can happen that provider_data/account_data change between
-            # 2 calls, the reason is that those field contains the encrypted information needed to access the provider
-            # and first call can result in an error due to the encrypted token inside provider_data being expired for example.
-            # In such a case, we renew the token with the provider and send back the newly encrypted token inside provider_data
-            # which result in the information having changed, henceforth why those field are passed at every loop.
-            data.update({
-                'provider_data': self.account_online_link_id.provider_data,
-                'account_data': self.account_data
-            })
-            resp_json = self.account_online_link_id._fetch_odoo_fin('/proxy/v1/refresh', data=data)
-            if resp_json.get('account_data'):
-                self.account_data = resp_json['account_data']
-            if resp_json.get('code') == 300:
-                return resp_json.get('data', {}).get('mode', 'error')
-            if not resp_json.get('next_data'):
-                break
-            data['next_data'] = resp_json.get('next_data') or {}
-        return True
+        status = False
+        while status is False:
+            status = self._refresh_step(data)
+        return status
+
+    def _refresh_step(self, data):
+        '''
+        Make one call of the refresh of the account with the proxy.
+        :param data: The data of the refresh request, updated with what is needed by the next call.
+        :return: True if the refresh is done, False if the proxy has to be polled again and the
+                 mode of the iframe to open if the user has to act on the link.
+        '''
+        # While this is kind of a bad practice to do, it can happen that provider_data/account_data change between
+        # 2 calls, the reason is that those field contains the encrypted information needed to access the provider
+        # and first call can result in an error due to the encrypted token inside provider_data being expired for example.
+        # In such a case, we renew the token with the provider and send back the newly encrypted token inside provider_data
+        # which result in the information having changed, henceforth why those field are passed at every loop.
+        data.update({
+            'provider_data': self.account_online_link_id.provider_data,
+            'account_data': self.account_data
+        })
+        resp_json = self.account_online_link_id._fetch_odoo_fin('/proxy/v1/refresh', data=data)
+        if resp_json.get('account_data'):
+            self.account_data = resp_json['account_data']
+        if resp_json.get('code') == 300:
+            return resp_json.get('data', {}).get('mode', 'error')
+        if not resp_json.get('next_data'):
+            return True
+        data['next_data'] = resp_json.get('next_data') or {}
+        return False
 
     def _retrieve_transactions(self):
         start_date = self.last_sync or fields.Date().today() - relativedelta(days=15)
@@ -83,6 +144,32 @@ class AccountOnlineAccount(models.Model):
             'last_transaction_identifier': last_stmt_line.online_transaction_identifier,
             'currency_code': self.journal_ids[0].currency_id.name,
         }
+        with sync_tracing.phase('download'):
+            if self._use_page_prefetch():
+                transactions = self._download_transactions_prefetched(data)
+            else:
+                transactions = self._download_transactions(data)
+
+        with sync_tracing.phase('statement'):
+            stmt_lines = self.env['account.bank.statement']._online_sync_bank_statement(transactions, self)
+        sync_tracing.count('transactions_inserted', len(stmt_lines.filtered('online_transaction_identifier')))
+        # Keep the history of the balance, once per synchronization rather than for every page
+        self.env['account.online.balance']._record_balance(self, self.balance, self._get_ledger_balance())
+        return stmt_lines
+
+    def _get_ledger_balance(self):
+        self.ensure_one()
+        last_statement = self.env['account.bank.statement'].search([('journal_id', 'in', self.journal_ids.ids)], order='date desc, id desc', limit=1)
+        return last_statement.balance_end
+
+    def _use_page_prefetch(self):
+        # The recorded responses are replayed in order, a prefetched page would be taken even if it is dropped
+        if sync_recording.current_replayer():
+            return False
+        return str2bool(self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.prefetch_pages', 'False'))
+
+    def _download_transactions(self, data):
+        transactions = []
         while True:
             # While this is kind of a bad practice to do, it can happen that provider_data/account_data change between
             # 2 calls, the reason is that those field contains the encrypted information needed to access the provider
@@ -94,16 +181,78 @@ class AccountOnlineAccount(models.Model):
                 'account_data': self.account_data
             })
             resp_json = self.account_online_link_id._fetch_odoo_fin('/proxy/v1/transactions', data=data)
-            if resp_json.get('balance'):
-                self.balance = resp_json['balance']
-            if resp_json.get('account_data'):
-                self.account_data = resp_json['account_data']
-            transactions += resp_json.get('transactions', [])
+            transactions += self._handle_transactions_page(resp_json)
             if not resp_json.get('next_data'):
                 break
             data['next_data'] = resp_json.get('next_data') or {}
+        return transactions
+
+    def _download_transactions_prefetched(self, data):
+        '''
+        Same as _download_transactions, but the next page is requested as soon as the current one is received,
+        so that it is on its way while the current one is handled. The next page is requested with the provider_data
+        and account_data renewed by the current page, the ones _download_transactions would send once the page is
+        handled. Should handling the page change them anyway, the prefetched page is dropped and requested again
+        with the new ones.
+        The pages are sent by a worker thread through a connection of its own, as requests.Session is not thread-safe.
+        '''
+        link = self.account_online_link_id
+        url = '/proxy/v1/transactions'
+        transactions = []
+        prefetch = None
+        with ThreadPoolExecutor(max_workers=1) as executor, requests.Session() as session:
+            try:
+                while True:
+                    data.update({
+                        'provider_data': link.provider_data,
+                        'account_data': self.account_data
+                    })
+                    if prefetch and prefetch[0] == self._get_prefetch_key(data):
+                        request, future = prefetch[1:]
+                    else:
+                        if prefetch:
+                            prefetch[2].cancel()
+                        request = dict(link._prepare_odoo_fin_request(url, data), session=session)
+                        future = executor.submit(send_odoo_fin_request, request)
+                    prefetch = None
+                    response = future.result()
+                    resp_json = response.get('json')
+                    result = isinstance(resp_json, dict) and not resp_json.get('error') and resp_json.get('result') or {}
+                    if result.get('next_data'):
+                        next_data = dict(
+                            data,
+                            next_data=result['next_data'],
+                            provider_data=result.get('provider_data') or data['provider_data'],
+                            account_data=result.get('account_data') or data['account_data'],
+                        )
+                        next_request = dict(link._prepare_odoo_fin_request(url, next_data), session=session)
+                        prefetch = (self._get_prefetch_key(next_data), next_request, executor.submit(send_odoo_fin_request, next_request))
+                    resp_json = link._handle_response(link._receive_odoo_fin_response(request, response), url, request['data'])
+                    transactions += self._handle_transactions_page(resp_json)
+                    if not resp_json.get('next_data'):
+                        break
+                    data['next_data'] = resp_json.get('next_data') or {}
+            finally:
+                # Do not send a page that will not be handled
+                if prefetch:
+                    prefetch[2].cancel()
+        return transactions
+
+    def _get_prefetch_key(self, data):
+        return (
+            data.get('provider_data'),
+            data.get('account_data'),
+            json.dumps(data.get('next_data'), sort_keys=True),
+            self.account_online_link_id.sudo().access_token,
+        )
 
-        return self.env['account.bank.statement']._online_sync_bank_statement(transactions, self)
+    def _handle_transactions_page(self, resp_json):
+        if resp_json.get('balance'):
+            self.balance = resp_json['balance']
+        if resp_json.get('account_data'):
+            self.account_data = resp_json['account_data']
+        sync_tracing.count('transactions_received', len(resp_json.get('transactions', [])))
+        return resp_json.get('transactions', [])
 
 
 class AccountOnlineLink(models.Model):
@@ -111,6 +260,11 @@ class AccountOnlineLink(models.Model):
     _description = 'Connection to an online banking institution'
     _inherit = ['mail.thread']
 
+    @api.depends('provider_data')
+    def _compute_has_provider_data(self):
+        for link in self:
+            link.has_provider_data = bool(link.provider_data)
+
     def _compute_next_synchronization(self):
         for rec in self:
             rec.next_refresh = self.env.ref('account_online_synchronization.online_sync_cron').sudo().nextcall
@@ -128,7 +282,22 @@ class AccountOnlineLink(models.Model):
     client_id = fields.Char(help="Represent a link for a given user towards a banking institution", readonly=True)
     refresh_token = fields.Char(help="Token used to sign API request, Never disclose it", readonly=True, groups="base.group_system")
     access_token = fields.Char(help="Token used to access API.", readonly=True, groups="account.group_account_manager")
-    provider_data = fields.Char(help="Information needed to interract with third party provider", readonly=True)
+    provider_data = fields.Char(help="Information needed to interract with third party provider", readonly=True, prefetch=False)
+    has_provider_data = fields.Boolean(compute='_compute_has_provider_data', store=True,
+        help="Technical field used in the views and the searches instead of the large provider_data")
+
+    # Backoff of the scheduled synchronization, see _update_sync_backoff
+    sync_failure_count = fields.Integer(readonly=True, help="Number of consecutive scheduled synchronizations that failed")
+    sync_retry_after = fields.Datetime("Retry After", readonly=True,
+        help="The scheduled synchronization skips this link until then, as its last synchronizations failed")
+    sync_quarantined = fields.Boolean("Waiting for Reconnection", readonly=True,
+        help="The scheduled synchronization skips this link until it is reconnected or its credentials are updated")
+
+    profile_next_sync = fields.Boolean("Profile next synchronization", groups="base.group_system",
+        help="Profile the next synchronization of this link and attach the report to it")
+    record_next_sync = fields.Boolean("Record next synchronization", groups="base.group_system",
+        help="Record the calls made to the proxy by the next synchronization of this link and attach them to it, "
+             "without the credentials, so that the synchronization can be replayed without reaching the bank")
 
     ##########################
     # Wizard opening actions #
@@ -175,15 +344,38 @@ class AccountOnlineLink(models.Model):
             "res_id": account_link_journal_wizard.id
         }
 
+    def _show_background_sync_action(self):
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Synchronization started'),
+                'message': _('Your transactions are being fetched in the background. You will be notified once it is done.'),
+                'sticky': False,
+                'next': {'type': 'ir.actions.act_window_close'},
+            },
+        }
+
     def _show_fetched_transactions_action(self, stmt_line_ids):
         if self.env.context.get('dont_show_transactions'):
             return
         return {
             'type': 'ir.actions.client',
             'tag': 'bank_statement_reconciliation_view',
-            'context': {'statement_line_ids': stmt_line_ids.ids, 'company_ids': self.mapped('company_id').ids},
+            'context': self._get_fetched_transactions_context(stmt_line_ids),
         }
 
+    def _get_fetched_transactions_context(self, stmt_line_ids):
+        context = {'company_ids': self.mapped('company_id').ids}
+        batch = self.env.context.get('online_sync_batch')
+        if batch:
+            # Only send the handle of the batch, the lines are read back by the reconciliation widget
+            # on the server side, see account.reconciliation.widget get_bank_statement_data.
+            context['online_sync_batch'] = batch
+        else:
+            context['statement_line_ids'] = stmt_line_ids.ids
+        return context
+
     #######################################################
     # Generic methods to contact server and handle errors #
     #######################################################
@@ -195,16 +387,25 @@ class AccountOnlineLink(models.Model):
         :param data: HTTP data request.
         :return: A dict containing all data.
         '''
+        request = self._prepare_odoo_fin_request(url, data, ignore_status)
+        resp_json = self._receive_odoo_fin_response(request, send_odoo_fin_request(request))
+        return self._handle_response(resp_json, url, request['data'], ignore_status)
+
+    def _prepare_odoo_fin_request(self, url, data=None, ignore_status=False):
+        '''
+        Prepare a call to the Odoo Fin proxy, waiting for the rate limits if needed.
+        :return: The request to give to send_odoo_fin_request, which does not need the environment.
+        '''
         if not data:
             data = {}
-        if self.state == 'disconnected' and not ignore_status:
+        if self._get_current_state() == 'disconnected' and not ignore_status:
             raise UserError(_('Please reconnect your online account.'))
 
-        timeout = int(self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.request_timeout')) or 60
+        timeout = self._get_request_timeout(url)
         proxy_mode = self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.proxy_mode') or 'production'
         if not pattern.match(proxy_mode):
             raise UserError(_('Invalid value for proxy_mode config parameter.'))
-        endpoint_url = 'https://%s.odoofin.com%s' % (proxy_mode, url)
+        endpoint_url = self._get_proxy_url(proxy_mode, url)
         data['utils'] = {
             'request_timeout': timeout,
             'lang': get_lang(self.env).code,
@@ -213,16 +414,84 @@ class AccountOnlineLink(models.Model):
             'cron': self.env.context.get('cron', False)
         }
 
-        try:
+        replayer = sync_recording.current_replayer()
+        if not replayer:
+            with sync_tracing.phase('throttle'):
+                self.env['account.online.rate.limit']._acquire(proxy_mode, self.name)
+
+        return {
+            'url': url,
+            'endpoint_url': endpoint_url,
+            'data': data,
+            'timeout': timeout,
             # We have to use sudo to pass record as some field are protected from read for common users.
-            resp = requests.post(url=endpoint_url, json=data, timeout=timeout, auth=OdooFinAuth(record=self.sudo()))
-            resp_json = resp.json()
-            return self._handle_response(resp_json, url, data, ignore_status)
-        except (Timeout, ConnectionError, RequestException, ValueError):
-            _logger.exception('synchronization error')
+            'auth': OdooFinAuth(record=self.sudo()),
+            'session': getattr(odoo_fin_transport, 'session', None),
+            'replayer': replayer,
+        }
+
+    def _receive_odoo_fin_response(self, request, response):
+        '''
+        :param request: The request prepared by _prepare_odoo_fin_request.
+        :param response: The result of send_odoo_fin_request for that request.
+        :return: The json-rpc response of the proxy.
+        '''
+        recorder = sync_recording.current_recorder()
+        if recorder:
+            recorder.record(request, response)
+        # The recorded durations are not the ones of the proxy right now, do not let a replay change the timeouts
+        replay = bool(request.get('replayer'))
+        if response.get('status'):
+            sync_tracing.record_request(request['url'], response['duration'], status=response['status'], size=response['size'])
+            if not replay:
+                self._record_request_latency(request['url'], response['duration'])
+        elif isinstance(response.get('exception'), Timeout) and not replay:
+            # The call took at least that long, let the next timeouts grow
+            self._record_request_latency(request['url'], request['timeout'])
+        if response.get('exception'):
+            _logger.error('synchronization error', exc_info=response['exception'])
             raise UserError(
                 _("The online synchronization service is not available at the moment. "
                   "Please try again later."))
+        return response['json']
+
+    def _get_latency_keys(self, url):
+        # The latencies are kept by institution, and for all of them to cover the ones with few calls
+        return [(self.env.cr.dbname, url, self.name), (self.env.cr.dbname, url, None)]
+
+    def _record_request_latency(self, url, duration):
+        with request_latencies_lock:
+            for key in self._get_latency_keys(url):
+                latencies = request_latencies.setdefault(key, [])
+                latencies.append(duration)
+                del latencies[:-LATENCY_WINDOW]
+
+    def _get_request_timeout(self, url):
+        '''
+        Compute the timeout of a call to an endpoint of the proxy from the durations of its last calls, so that a hung
+        call to a light endpoint is detected quickly while a heavy one still gets the time it usually needs.
+        :return: The timeout in seconds, between the request_timeout_floor and request_timeout_max parameters, or the
+                 request_timeout parameter until enough calls have been observed.
+        '''
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        default = int(get_param('account_online_synchronization.request_timeout') or 60) or 60
+        if not str2bool(get_param('account_online_synchronization.adaptive_timeout', 'True')):
+            return default
+        ceiling = float(get_param('account_online_synchronization.request_timeout_max', 180))
+        floor = min(float(get_param('account_online_synchronization.request_timeout_floor', 5)), ceiling)
+        factor = float(get_param('account_online_synchronization.request_timeout_factor', 3))
+        with request_latencies_lock:
+            for key in self._get_latency_keys(url):
+                latencies = sorted(request_latencies.get(key, []))
+                if len(latencies) >= LATENCY_MIN_SAMPLES:
+                    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+                    return int(math.ceil(max(floor, min(ceiling, p99 * factor))))
+        # Not enough calls observed yet
+        return default
+
+    @api.model
+    def _get_proxy_url(self, proxy_mode, url):
+        return 'https://%s.odoofin.com%s' % (proxy_mode, url)
 
     def _handle_response(self, resp_json, url, data, ignore_status=False):
         # Response is a json-rpc response, therefore data is encapsulated inside error in case of error
@@ -240,7 +509,7 @@ class AccountOnlineLink(models.Model):
                 # are received during a transaction containing multiple calls to the proxy, we ensure
                 # that provider_data is commited in database as soon as we received it.
                 self.provider_data = result.get('provider_data')
-                self.env.cr.commit()
+                self._commit_synchronization()
             return result
         else:
             error = resp_json.get('error')
@@ -254,7 +523,7 @@ class AccountOnlineLink(models.Model):
                 # We need to commit here because if we got a new refresh token, and a new access token
                 # It means that the token is active on the proxy and any further call resulting in an
                 # error would loose the new refresh_token hence blocking the account ad vitam eternam
-                self.env.cr.commit()
+                self._commit_synchronization()
                 return self._fetch_odoo_fin(url, data, ignore_status)
             elif error.get('code') == 300: # redirect, not an error
                 return error
@@ -278,7 +547,16 @@ class AccountOnlineLink(models.Model):
         # and then raise the error to the end user. To do that we first rollback the current transaction,
         # then we write the error on the record, we commit those changes and finally we raise the error.
         if reset_tx:
-            self.env.cr.rollback()
+            self._rollback_synchronization()
+        digest = sync_digest.current()
+        if digest is not None:
+            # Unattended run: keep everything in memory, see _flush_sync_digest
+            if state == 'error' and self._get_current_state() == 'disconnected':
+                state = 'disconnected'
+            digest.log(self.id, state=state, subject=subject, message=message)
+            if reset_tx:
+                raise UserError(message)
+            return
         try:
             # if state is disconnected, and newstate is error: ignore it
             if state == 'error' and self.state == 'disconnected':
@@ -289,13 +567,38 @@ class AccountOnlineLink(models.Model):
                 self.write({'state': state})
             if reset_tx:
                 # In case of reset_tx, we commit the changes and then raise the error (see comment at the start of the method)
-                self.env.cr.commit()
+                self._commit_synchronization()
                 raise UserError(message)
         except (CacheMiss, MissingError):
             # This exception can happen if record was created and rollbacked due to error in same transaction
             # Therefore it is not possible to log information on it, in this case we just ignore it.
             pass
 
+    def _get_current_state(self):
+        digest = sync_digest.current()
+        return digest.get_state(self.id, self.state) if digest is not None else self.state
+
+    def _flush_sync_digest(self, digest):
+        '''
+        Write what has been collected in the digest during an unattended run: the state changes are
+        written in bulk without tracking and the messages of every link are posted as one summary.
+        '''
+        changes = {}
+        state_names = dict(self._fields['state']._description_selection(self.env))
+        for link in self.exists():
+            state, messages = digest.pop(link.id)
+            lines = []
+            if state and state != link.state:
+                changes.setdefault(state, self.browse())
+                changes[state] |= link
+                lines.append(_('Status: %s &#8594; %s') % (state_names.get(link.state), state_names.get(state)))
+            for subject, message in messages:
+                lines.append('<b>%s</b> <br> %s' % (subject, message.replace('\n', '<br>')))
+            if lines:
+                link.message_post(body='<br>'.join(lines), subject=_('Synchronization summary'))
+        for state, links in changes.items():
+            links.with_context(tracking_disable=True).write({'state': state})
+
     ###############
     # API methods #
     ###############
@@ -303,13 +606,16 @@ class AccountOnlineLink(models.Model):
     def _get_access_token(self):
         for link in self:
             resp_json = link._fetch_odoo_fin('/proxy/v1/get_access_token', ignore_status=True)
-            link.access_token = resp_json.get('access_token', False)
+            # The tokens are redacted from the recordings, keep the ones of the link when replaying
+            if not sync_recording.current_replayer():
+                link.access_token = resp_json.get('access_token', False)
 
     def _get_refresh_token(self):
         # Use sudo as refresh_token field is not accessible to most user
         for link in self.sudo():
             resp_json = link._fetch_odoo_fin('/proxy/v1/renew_token', ignore_status=True)
-            link.refresh_token = resp_json.get('refresh_token', False)
+            if not sync_recording.current_replayer():
+                link.refresh_token = resp_json.get('refresh_token', False)
 
     def unlink(self):
         to_unlink = self.env['account.online.link']
@@ -323,7 +629,11 @@ class AccountOnlineLink(models.Model):
         if to_unlink:
             return super(AccountOnlineLink, to_unlink).unlink()
 
-    def _fetch_accounts(self, add_new_accounts=True):
+    def _fetch_remote_accounts(self):
+        '''
+        List the accounts of the link on the proxy.
+        :return: A dict containing the values of the remote accounts by online_identifier.
+        '''
         self.ensure_one()
         accounts = {}
         data = {}
@@ -341,34 +651,413 @@ class AccountOnlineLink(models.Model):
             if not resp_json.get('next_data'):
                 break
             data['next_data'] = resp_json.get('next_data')
+        return accounts
 
-        accounts_to_delete = self.env['account.online.account']
+    def _fetch_accounts(self, add_new_accounts=True):
+        '''
+        Synchronize the online accounts of the link with the accounts listed by the proxy: the missing accounts are
+        created, the ones that disappeared are deleted and the others are updated with the values that changed.
+        :param add_new_accounts: Whether to create the accounts that are not known yet.
+        :return: The created account.online.account.
+        '''
+        self.ensure_one()
+        OnlineAccount = self.env['account.online.account']
+        accounts = self._fetch_remote_accounts()
+        accounts_to_delete = OnlineAccount
+        accounts_to_write = {}
         for account in self.account_online_account_ids:
-            # pop from accounts to create as it already exists, otherwise mark for deletion
-            if not accounts.pop(account.online_identifier):
+            vals = accounts.get(account.online_identifier)
+            if vals is None:
                 accounts_to_delete += account
+                continue
+            changes = tuple(sorted(
+                (fname, value) for fname, value in vals.items()
+                if fname in OnlineAccount._fields and fname not in ('online_identifier', 'account_online_link_id')
+                and (account._fields[fname].convert_to_write(account[fname], account) or False) != (value or False)
+            ))
+            if changes:
+                # Accounts with the same changes are written at once
+                accounts_to_write[changes] = accounts_to_write.get(changes, OnlineAccount) + account
 
+        for changes, accounts_to_update in accounts_to_write.items():
+            accounts_to_update.write(dict(changes))
+        new_accounts = OnlineAccount
+        existing_identifiers = set(self.account_online_account_ids.mapped('online_identifier'))
+        vals_list = [
+            {fname: value for fname, value in vals.items() if fname in OnlineAccount._fields}
+            for identifier, vals in accounts.items() if identifier not in existing_identifiers
+        ]
+        if add_new_accounts and vals_list:
+            new_accounts = OnlineAccount.create(vals_list)
+        # Delete the accounts last, the link is deleted with its last account
         accounts_to_delete.unlink()
-        new_accounts = self.env['account.online.account']
-        if add_new_accounts and accounts:
-            new_accounts = self.env['account.online.account'].create(accounts.values())
         return new_accounts
 
+    def _is_cron_sync_allowed(self):
+        self.ensure_one()
+        if self.sync_quarantined or self.state == 'disconnected':
+            return False
+        return not self.sync_retry_after or self.sync_retry_after <= fields.Datetime.now()
+
+    def _update_sync_backoff(self, failed=False, needs_action=False):
+        '''
+        Update the backoff of the link after a scheduled synchronization. A link that needs the user to act on it is
+        quarantined from the cron, while a link that fails is retried after a delay doubling with each failure.
+        :param failed: Whether the synchronization failed.
+        :param needs_action: Whether the user has to act on the link (reconnect, ...) before it can be synchronized.
+        '''
+        self.ensure_one()
+        if needs_action or self.state == 'disconnected':
+            vals = {'sync_quarantined': True}
+        elif failed:
+            get_param = self.env['ir.config_parameter'].sudo().get_param
+            base = float(get_param('account_online_synchronization.backoff_base_hours', 1))
+            ceiling = float(get_param('account_online_synchronization.backoff_max_hours', 168))
+            failure_count = self.sync_failure_count + 1
+            vals = {
+                'sync_failure_count': failure_count,
+                'sync_retry_after': fields.Datetime.now() + relativedelta(hours=min(base * 2 ** (failure_count - 1), ceiling)),
+            }
+        elif self.sync_failure_count or self.sync_retry_after:
+            vals = {'sync_failure_count': 0, 'sync_retry_after': False}
+        else:
+            return
+        self.sudo().write(vals)
+
+    def _reset_sync_backoff(self):
+        '''
+        Give the links back to the cron after a successful synchronization or an action of the user on them.
+        '''
+        links = self.filtered(lambda l: l.sync_failure_count or l.sync_retry_after or l.sync_quarantined)
+        if links:
+            links.sudo().write({'sync_failure_count': 0, 'sync_retry_after': False, 'sync_quarantined': False})
+
+    def _get_sync_staleness_order(self, attempted_before=None):
+        '''
+        Order the links from the one synchronized the longest ago, failed attempts included so that a link
+        failing at every run does not stay first forever.
+        :param attempted_before: If given, only keep the links whose last attempt is older than this datetime.
+        :return: A list of tuples (link, expected duration of its synchronization in seconds).
+        '''
+        if not self:
+            return []
+        # Last run of every link, using the (link, date_start) index of the runs
+        self.env['account.online.sync.run'].flush(['account_online_link_id', 'date_start', 'duration'])
+        self.env.cr.execute("""
+            SELECT DISTINCT ON (account_online_link_id) account_online_link_id, date_start, duration
+              FROM account_online_sync_run
+             WHERE account_online_link_id IN %s
+          ORDER BY account_online_link_id, date_start DESC
+        """, [tuple(self.ids)])
+        last_runs = {link_id: (date_start, duration) for link_id, date_start, duration in self.env.cr.fetchall()}
+
+        def last_attempt(link):
+            dates = [date for date in (link.last_refresh, last_runs.get(link.id, (None,))[0]) if date]
+            return max(dates) if dates else datetime.min
+
+        links = self.sorted(lambda l: (last_attempt(l), l.id))
+        if attempted_before:
+            links = links.filtered(lambda l: last_attempt(l) < attempted_before)
+        return [(link, last_runs.get(link.id, (None, 0.0))[1] or 0.0) for link in links]
+
+    @contextmanager
+    def _lock_synchronization(self):
+        '''
+        Try to lock the synchronization of the link, so that a user and the cron, or two users, do not
+        download and import the same transactions at the same time. The lock is a transaction level
+        advisory lock held by a dedicated cursor, it is therefore kept across the commits done during
+        the synchronization and released whatever happens, even if the worker is killed.
+        :return: A context manager giving whether the lock has been acquired.
+        '''
+        self.ensure_one()
+        with self.pool.cursor() as cr:
+            cr.execute('SELECT pg_try_advisory_xact_lock(%s, %s)', [SYNC_LOCK_NAMESPACE, self.id])
+            yield cr.fetchone()[0]
+
+    def _show_sync_in_progress_action(self):
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Synchronization in progress'),
+                'message': _('The transactions of %s are already being fetched, they will be available once it is done.', self.name),
+                'type': 'warning',
+                'sticky': False,
+                'next': {'type': 'ir.actions.act_window_close'},
+            },
+        }
+
     def _fetch_transactions(self, refresh=True, accounts=False):
+        self.ensure_one()
+        with self._lock_synchronization() as locked:
+            if not locked:
+                _logger.info('Online sync: link %s is already being synchronized, skipping it', self.id)
+                if self.env.context.get('cron'):
+                    return SYNC_BUSY
+                return self._show_sync_in_progress_action()
+            return self._fetch_transactions_locked(refresh=refresh, accounts=accounts)
+
+    def _fetch_transactions_locked(self, refresh=True, accounts=False):
+        self.ensure_one()
+        profile = self.env.context.get('online_sync_profile') or self.sudo().profile_next_sync
+        if profile:
+            # Only profile once, if the synchronization fails, this is rollbacked and the next one is profiled again
+            self.sudo().profile_next_sync = False
+        tracer = sync_tracing.SyncProfiler() if profile else sync_tracing.SyncTracer()
+        record = self.env.context.get('online_sync_record') or self.sudo().record_next_sync
+        if record:
+            self.sudo().record_next_sync = False
+        recorder = sync_recording.SyncRecorder() if record else sync_recording.current_recorder()
+        # Stamp the statement lines created by this synchronization, so that they can be shown by batch
+        batch = uuid.uuid4().hex
+        link = self.with_context(online_sync_batch=batch)
+        try:
+            with sync_tracing.tracing(tracer), sync_recording.recording(recorder), self._odoo_fin_session():
+                res = link._fetch_transactions_run(refresh=refresh, accounts=accounts and accounts.with_context(online_sync_batch=batch))
+        except Exception as e:
+            # The transaction is rollbacked by the caller anyway, do it ourselves to keep a trace of the failure
+            self._rollback_synchronization()
+            # The link itself may have been created in the rollbacked transaction
+            if self.exists():
+                self.env['account.online.sync.run']._record_run(self, tracer, error=str(e), batch=batch)
+                self._commit_synchronization()
+            raise
+        finally:
+            if profile:
+                self._save_sync_profile(tracer)
+            if record:
+                self._save_sync_recording(recorder)
+        self.env['account.online.sync.run']._record_run(self, tracer, batch=batch)
+        return res
+
+    @contextmanager
+    def _odoo_fin_session(self):
+        '''
+        Send the calls to the proxy made within this block through the same requests.Session, so that the
+        connection to the proxy is kept alive between the calls made for all the accounts of the link.
+        '''
+        if getattr(odoo_fin_transport, 'session', None) is not None:
+            yield odoo_fin_transport.session
+            return
+        with requests.Session() as session:
+            odoo_fin_transport.session = session
+            try:
+                yield session
+            finally:
+                odoo_fin_transport.session = None
+
+    @contextmanager
+    def _sync_attachment_cursor(self):
+        '''
+        Cursor saving the attachments of a synchronization whatever happens to its transaction.
+        '''
+        with self.pool.cursor() as cr:
+            yield cr
+
+    def _save_sync_profile(self, profiler):
+        self.ensure_one()
+        name = 'sync_profile_%s' % fields.Datetime.now().strftime('%Y%m%d_%H%M%S')
+        attachments = [{
+            'name': name + '.txt',
+            'datas': base64.b64encode(profiler.get_report().encode('utf-8')),
+            'mimetype': 'text/plain',
+        }, {
+            'name': name + '.prof',
+            'datas': base64.b64encode(profiler.get_stats_dump()),
+            'mimetype': 'application/octet-stream',
+        }]
+        # Use a separate cursor as the synchronization may be rollbacked because of an error
+        # and the profile of a failing synchronization is the most interesting one.
+        with self._sync_attachment_cursor() as cr:
+            self.env(cr=cr)['ir.attachment'].sudo().create([dict(vals, res_model=self._name, res_id=self.id) for vals in attachments])
+
+    def _save_sync_recording(self, recorder):
+        self.ensure_one()
+        name = 'sync_recording_%s.json' % fields.Datetime.now().strftime('%Y%m%d_%H%M%S')
+        data = recorder.dumps(institution=self.name, date=fields.Datetime.to_string(fields.Datetime.now()))
+        # Use a separate cursor for the same reason as _save_sync_profile
+        with self._sync_attachment_cursor() as cr:
+            self.env(cr=cr)['ir.attachment'].sudo().create({
+                'name': name,
+                'datas': base64.b64encode(data.encode('utf-8')),
+                'mimetype': 'application/json',
+                'res_model': self._name,
+                'res_id': self.id,
+            })
+
+    def _replay_sync_recording(self, attachment, refresh=True, latency=False):
+        '''
+        Run a synchronization of the link with the calls to the proxy answered by a recording, see record_next_sync.
+        The whole synchronization runs (refresh, download of the transactions, creation and posting of the statements)
+        without reaching the proxy nor committing, so that it can be profiled (with the online_sync_profile context key)
+        and rollbacked at will. The transactions already imported in the journals are skipped as usual, replay on a
+        copy of the database taken before the recorded synchronization to reproduce it.
+        :param attachment: The ir.attachment of the recording.
+        :param latency: Whether to wait for the recorded duration of the calls, to reproduce the timings of the proxy.
+        :return: A tuple with the result of the synchronization and the number of recorded calls that have not been replayed.
+        '''
+        self.ensure_one()
+        replayer = sync_recording.SyncReplayer(base64.b64decode(attachment.datas), latency=latency)
+        accounts = self.account_online_account_ids.filtered(lambda account: account.online_identifier in replayer.accounts)
+        with sync_recording.replaying(replayer):
+            res = self.with_context(dont_show_transactions=True)._fetch_transactions_locked(refresh=refresh, accounts=accounts)
+        return res, replayer.remaining()
+
+    def _commit_synchronization(self):
+        # A replay runs in the transaction of its caller, see _replay_sync_recording
+        if not sync_recording.current_replayer():
+            self.env.cr.commit()
+
+    def _rollback_synchronization(self):
+        if not sync_recording.current_replayer():
+            self.env.cr.rollback()
+
+    def _fetch_transactions_run(self, refresh=True, accounts=False):
         self.ensure_one()
         self.last_refresh = fields.Datetime.now()
+        # Only get transactions on account linked to a journal
+        online_accounts = (accounts or self.account_online_account_ids).filtered('journal_ids')
+        if refresh and len(online_accounts) > 1 and self._use_pipelined_refresh():
+            bank_statement_line_ids, status = self._refresh_and_retrieve_pipelined(online_accounts)
+        else:
+            bank_statement_line_ids, status = self._refresh_and_retrieve(online_accounts, refresh=refresh)
+        if status is not True:
+            return self._open_iframe(status)
+        # Whoever synchronized the link, the cron can synchronize it again
+        self._reset_sync_backoff()
+        return self._show_fetched_transactions_action(bank_statement_line_ids)
+
+    def _use_pipelined_refresh(self):
+        return str2bool(self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.pipelined_refresh', 'False'))
+
+    def _refresh_and_retrieve(self, online_accounts, refresh=True):
+        '''
+        Refresh and fetch the transactions of the accounts one after the other.
+        :return: A tuple with the created statement lines and True, or the mode of the iframe to open
+                 if the refresh of an account needs an action of the user.
+        '''
         bank_statement_line_ids = self.env['account.bank.statement.line']
-        acc = accounts or self.account_online_account_ids
-        for online_account in acc:
-            # Only get transactions on account linked to a journal
-            if online_account.journal_ids:
-                if refresh:
+        for index, online_account in enumerate(online_accounts):
+            if refresh:
+                with sync_tracing.phase('refresh'):
                     status = online_account._refresh()
-                    if status is not True:
-                        return self._open_iframe(status)
+                if status is not True:
+                    return bank_statement_line_ids, status
+            bank_statement_line_ids += online_account._retrieve_transactions()
+            self._notify_sync_progress(index + 1, len(online_accounts))
+        return bank_statement_line_ids, True
+
+    def _refresh_and_retrieve_pipelined(self, online_accounts):
+        '''
+        Same as _refresh_and_retrieve, but the refreshes of all the accounts are started first and then
+        polled together, the transactions of an account being fetched as soon as its refresh is done.
+        As the provider spends most of the refresh time waiting on the bank, the synchronization of the
+        link takes about as long as its slowest account instead of the sum of all of them.
+        '''
+        bank_statement_line_ids = self.env['account.bank.statement.line']
+        refresh_data = {online_account: {'account_id': online_account.online_identifier} for online_account in online_accounts}
+        done = 0
+        while refresh_data:
+            for online_account in list(refresh_data):
+                with sync_tracing.phase('refresh'):
+                    status = online_account._refresh_step(refresh_data[online_account])
+                if status is False:
+                    continue
+                if status is not True:
+                    return bank_statement_line_ids, status
+                del refresh_data[online_account]
                 bank_statement_line_ids += online_account._retrieve_transactions()
+                done += 1
+                self._notify_sync_progress(done, len(online_accounts))
+        return bank_statement_line_ids, True
 
-        return self._show_fetched_transactions_action(bank_statement_line_ids)
+    def _notify_sync_progress(self, done, total):
+        job = self.env['account.online.sync.job'].browse(self.env.context.get('online_sync_job_id'))
+        if job:
+            job._notify_progress(done, total)
+
+    def _use_background_sync(self):
+        # The cron and the queued jobs are already running in the background
+        if self.env.context.get('cron') or self.env.context.get('online_sync_job_id'):
+            return False
+        return str2bool(self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.background_sync', 'False'))
+
+    def _fetch_transactions_in_background(self, refresh=True, accounts=False):
+        '''
+        Queue the synchronization of the links instead of running it in the current request.
+        The user is notified through the bus once the job is done.
+        :return: An action notifying the user that the synchronization has been queued.
+        '''
+        show_transactions = not self.env.context.get('dont_show_transactions')
+        for link in self:
+            link_accounts = accounts and accounts.filtered(lambda a: a.account_online_link_id == link)
+            self.env['account.online.sync.job']._enqueue(link, accounts=link_accounts, refresh=refresh, show_transactions=show_transactions)
+        return self._show_background_sync_action()
+
+    ######################################
+    # Push notifications from the proxy #
+    ######################################
+
+    @api.model
+    def _receive_push_notification(self, headers, path, query_params, body):
+        '''
+        Handle a notification of the proxy telling that new transactions are available for some accounts.
+        The notification is signed the same way as the requests sent to the proxy (see OdooFinAuth), and is
+        only accepted once (see account.online.notification).
+        A synchronization of the accounts is queued, the notifications received in a short time being
+        coalesced into a single synchronization of the link.
+        :param headers: The headers of the request, with the odoofin-client-id, odoofin-timestamp and odoofin-signature.
+        :param path: The path of the request.
+        :param query_params: The query parameters of the request.
+        :param body: The json content of the request, with the online_identifier of the accounts in account_ids,
+                     every account of the link is synchronized if not given.
+        :return: False if the notification is refused, the sync job otherwise.
+        '''
+        client_id = headers.get('odoofin-client-id')
+        timestamp = headers.get('odoofin-timestamp')
+        signature = headers.get('odoofin-signature')
+        if not client_id or not timestamp or not signature:
+            return False
+        link = self.sudo().search([('client_id', '=', client_id)], limit=1)
+        if not link or not link.refresh_token:
+            return False
+        max_age = int(self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.push_max_age', 300))
+        try:
+            if abs(time.time() - int(timestamp)) > max_age:
+                return False
+        except ValueError:
+            return False
+        expected = OdooFinAuth(record=link).get_signature(timestamp, path, query_params, body)
+        if not hmac.compare_digest(expected, signature.encode('utf-8')):
+            _logger.warning('Online sync: refused a notification with an invalid signature for link %s', link.id)
+            return False
+        if not self.env['account.online.notification'].sudo()._register(link, int(timestamp), signature):
+            _logger.warning('Online sync: refused a notification already received for link %s', link.id)
+            return False
+
+        accounts = link.account_online_account_ids.filtered('journal_ids')
+        if body.get('account_ids'):
+            identifiers = set(str(identifier) for identifier in body['account_ids'])
+            accounts = accounts.filtered(lambda a: a.online_identifier in identifiers)
+        if not accounts or not link.auto_sync or link.state == 'disconnected':
+            return self.env['account.online.sync.job']
+        delay = int(self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.push_coalesce_delay', 60))
+        # The provider already has the new transactions, no need to ask for a refresh
+        return self.env['account.online.sync.job'].with_user(link._get_push_sync_user())._enqueue(
+            link, accounts=accounts, refresh=False, show_transactions=False, delay=delay)
+
+    def _get_push_sync_user(self):
+        '''
+        :return: The user running the synchronizations notified by the proxy, so that they are subject to the
+                 same access rights as the other ones: the user who last synchronized the link in the background,
+                 or the one who created the link.
+        '''
+        self.ensure_one()
+        last_job = self.env['account.online.sync.job'].sudo().search([
+            ('account_online_link_id', '=', self.id),
+            ('user_id.active', '=', True),
+        ], order='id desc', limit=1)
+        return last_job.user_id or self.sudo().create_uid
 
     ################################
     # Callback methods from iframe #
@@ -397,7 +1086,10 @@ class AccountOnlineLink(models.Model):
             self.env.cr.rollback()
             self._log_information(state='error', subject=_('Internal Error'), message=message, reset_tx=True)
             raise UserError(message)
-        return method()
+        res = method()
+        # The user has just acted on the link, let the cron synchronize it again
+        self._reset_sync_backoff()
+        return res
 
     def exchange_token(self, exchange_token):
         self.ensure_one()
@@ -429,11 +1121,14 @@ class AccountOnlineLink(models.Model):
 
     def _success_updateCredentials(self):
         self.ensure_one()
+        # The accounts available with the new credentials may differ
         self._fetch_accounts(add_new_accounts=False)
         return {'type': 'ir.actions.client', 'tag': 'reload'}
 
     def _success_refreshAccounts(self):
         self.ensure_one()
+        if self._use_background_sync():
+            return self._fetch_transactions_in_background(refresh=False)
         return self._fetch_transactions(refresh=False)
 
     def _success_reconnect(self):
@@ -449,7 +1144,7 @@ class AccountOnlineLink(models.Model):
         # Search for an existing link that was not fully connected
         online_link = self
         if not online_link:
-            online_link = self.search([('account_online_account_ids', '=', False), ('provider_data', '=', False)], limit=1)
+            online_link = self.search([('account_online_account_ids', '=', False), ('has_provider_data', '=', False)], limit=1)
         # If not found, create a new one
         if not online_link:
             online_link = self.create({})
@@ -462,6 +1157,8 @@ class AccountOnlineLink(models.Model):
         return self._open_iframe('updateAccounts')
 
     def action_fetch_transactions(self):
+        if self._use_background_sync():
+            return self._fetch_transactions_in_background()
         return self._fetch_transactions()
 
     def action_reconnect_account(self):
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from odoo import api, fields, models
+
+
+class AccountOnlineBalance(models.Model):
+    _name = 'account.online.balance'
+    _description = 'Balance of an online account at a date'
+    _order = 'date desc, id desc'
+    _rec_name = 'date'
+    # There is one record per account and per day, keep the rows as small as possible
+    _log_access = False
+
+    account_online_account_id = fields.Many2one('account.online.account', string='Account', required=True, readonly=True, ondelete='cascade')
+    account_online_link_id = fields.Many2one('account.online.link', related='account_online_account_id.account_online_link_id')
+    date = fields.Date(required=True, readonly=True)
+    balance = fields.Float(readonly=True, group_operator='avg', help="Balance of the account sent by the third party provider")
+    ledger_balance = fields.Float(readonly=True, group_operator='avg', help="Ending balance of the last bank statement of the journal")
+    drift = fields.Float(readonly=True, group_operator='avg', help="Difference between the balance sent by the provider and the ledger balance")
+
+    _sql_constraints = [
+        # Also the index of the queries by account and date range
+        ('unique_account_date', 'unique(account_online_account_id, date)', 'There is only one balance per account and per day.'),
+    ]
+
+    @api.model
+    def _record_balance(self, online_account, balance, ledger_balance, date=None):
+        '''
+        Save the balance of an online account at the end of a synchronization. The last synchronization of a day
+        replaces the balances of the previous ones, so that the table grows by at most one row per account and per day.
+        :param online_account: The synchronized account.online.account.
+        :param balance: The balance sent by the provider.
+        :param ledger_balance: The balance of the account computed from the bank statements.
+        :param date: The date of the balance, today by default.
+        '''
+        currency = online_account.journal_ids[:1].currency_id or online_account.company_id.currency_id
+        drift = currency.round(balance - ledger_balance) if currency else balance - ledger_balance
+        self.flush(['account_online_account_id', 'date'])
+        self.env.cr.execute("""
+            INSERT INTO account_online_balance (account_online_account_id, date, balance, ledger_balance, drift)
+                 VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (account_online_account_id, date)
+              DO UPDATE SET balance = EXCLUDED.balance, ledger_balance = EXCLUDED.ledger_balance, drift = EXCLUDED.drift
+        """, [online_account.id, date or fields.Date.context_today(self), balance, ledger_balance, drift])
+        self.invalidate_cache()
+
+    @api.model
+    def _get_balances_at(self, online_accounts, date):
+        '''
+        :return: The last balance of every account known at the given date, the accounts without any being left out.
+        '''
+        self.flush()
+        self.env.cr.execute("""
+            SELECT DISTINCT ON (account_online_account_id) id
+              FROM account_online_balance
+             WHERE account_online_account_id IN %s
+               AND date <= %s
+          ORDER BY account_online_account_id, date DESC
+        """, [tuple(online_accounts.ids) or (None,), date])
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
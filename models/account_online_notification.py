@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from odoo import api, fields, models
+
+
+class AccountOnlineNotification(models.Model):
+    _name = 'account.online.notification'
+    _description = 'Notification received from the proxy'
+    _order = 'id desc'
+    # There is one record per notification, only kept while it could be replayed, see push_max_age
+    _log_access = False
+
+    account_online_link_id = fields.Many2one('account.online.link', string='Link', required=True, readonly=True, ondelete='cascade')
+    timestamp = fields.Integer(required=True, readonly=True, help="Timestamp of the notification, as signed by the proxy")
+    signature = fields.Char(required=True, readonly=True)
+
+    _sql_constraints = [
+        ('unique_link_signature', 'unique(account_online_link_id, signature)', 'A notification is only received once.'),
+    ]
+
+    @api.model
+    def _register(self, link, timestamp, signature):
+        '''
+        Remember a notification of the proxy, so that it can not be sent again by someone who captured it.
+        :param link: The notified account.online.link.
+        :param timestamp: The signed timestamp of the notification.
+        :param signature: The signature of the notification, covering its timestamp and content.
+        :return: Whether the notification is received for the first time.
+        '''
+        self.flush()
+        self.env.cr.execute("""
+            INSERT INTO account_online_notification (account_online_link_id, timestamp, signature)
+                 VALUES (%s, %s, %s)
+            ON CONFLICT (account_online_link_id, signature) DO NOTHING
+              RETURNING id
+        """, [link.id, timestamp, signature])
+        return bool(self.env.cr.fetchone())
+
+    @api.autovacuum
+    def _gc_notifications(self):
+        # Older notifications are refused anyway because of their timestamp
+        max_age = int(self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.push_max_age', 300))
+        self.sudo().search([('timestamp', '<', int(time.time()) - 2 * max_age)]).unlink()
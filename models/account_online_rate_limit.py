@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from contextlib import contextmanager
+
+from odoo import api, fields, models, tools
+
+_logger = logging.getLogger(__name__)
+
+
+class AccountOnlineRateLimit(models.Model):
+    _name = 'account.online.rate.limit'
+    _description = 'Rate limit of the calls to the Odoo Fin proxy'
+    _order = 'proxy_mode, institution'
+
+    proxy_mode = fields.Char(required=True, default='production', help="Proxy on which the limit applies")
+    institution = fields.Char(help="Name of the banking institution on which the limit applies, leave empty to limit all the calls to the proxy")
+    rate = fields.Float("Requests per second", required=True, default=1.0)
+    burst = fields.Integer(required=True, default=5, help="Number of requests that can be sent at once before being throttled")
+
+    # State of the token bucket, shared between all the workers
+    tokens = fields.Float(readonly=True)
+    last_refill = fields.Float(readonly=True)
+
+    _sql_constraints = [
+        ('positive_rate', 'check(rate > 0)', 'The rate limit must allow at least some requests.'),
+        ('positive_burst', 'check(burst >= 1)', 'The burst must allow at least one request.'),
+    ]
+
+    def init(self):
+        # One limit per proxy and institution, the limit of the whole proxy included: a unique constraint
+        # would let any number of limits without institution through as NULL values are all distinct.
+        tools.create_unique_index(self._cr, 'account_online_rate_limit_unique_limit_index', self._table,
+                                  ['proxy_mode', "COALESCE(institution, '')"])
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.clear_caches()
+        return super(AccountOnlineRateLimit, self).create(vals_list)
+
+    def write(self, vals):
+        self.clear_caches()
+        return super(AccountOnlineRateLimit, self).write(vals)
+
+    def unlink(self):
+        self.clear_caches()
+        return super(AccountOnlineRateLimit, self).unlink()
+
+    @api.model
+    @tools.ormcache('proxy_mode', 'institution')
+    def _get_limit_ids(self, proxy_mode, institution):
+        limits = self.sudo().search([
+            ('proxy_mode', '=', proxy_mode),
+            '|', ('institution', '=', False), ('institution', '=', institution or False),
+        ])
+        # Always lock the buckets in the same order to avoid deadlocks between workers
+        return tuple(sorted(limits.ids))
+
+    @api.model
+    def _acquire(self, proxy_mode, institution=None):
+        '''
+        Wait until a call to the proxy is allowed by the rate limits of the proxy and of the institution.
+        A token is taken from each bucket right away, possibly going below zero, and the caller sleeps
+        until the bucket would have been refilled. The calls of all the workers are therefore spread
+        at the configured rate instead of being sent at once and rejected by the provider.
+        '''
+        limit_ids = self._get_limit_ids(proxy_mode, institution)
+        if not limit_ids:
+            return
+        # Use a separate cursor so that the buckets are not locked until the end of the synchronization,
+        # and refill all of them at once as the call is sent to the proxy anyway.
+        with self._bucket_cursor() as cr:
+            cr.execute("""
+                WITH locked AS (
+                    SELECT id, EXTRACT(EPOCH FROM clock_timestamp())::float AS now
+                      FROM account_online_rate_limit
+                     WHERE id IN %s
+                  ORDER BY id
+                       FOR UPDATE
+                )
+                UPDATE account_online_rate_limit lim
+                   SET tokens = CASE
+                           WHEN lim.last_refill IS NULL THEN lim.burst
+                           ELSE LEAST(lim.burst, COALESCE(lim.tokens, 0) + (locked.now - lim.last_refill) * lim.rate)
+                       END - 1,
+                       last_refill = locked.now
+                  FROM locked
+                 WHERE lim.id = locked.id
+             RETURNING lim.tokens, lim.rate
+            """, [limit_ids])
+            rows = cr.fetchall()
+        wait = max([-tokens / rate for tokens, rate in rows if tokens < 0] or [0])
+        if wait:
+            _logger.debug('Online sync: throttling the calls to the proxy %s for %.2fs', proxy_mode, wait)
+            time.sleep(wait)
+
+    @contextmanager
+    def _bucket_cursor(self):
+        with self.pool.cursor() as cr:
+            yield cr
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from dateutil.relativedelta import relativedelta
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+
+class AccountOnlineSyncJob(models.Model):
+    _name = 'account.online.sync.job'
+    _description = 'Queued online synchronization'
+    _order = 'id'
+
+    account_online_link_id = fields.Many2one('account.online.link', required=True, readonly=True, ondelete='cascade', index=True)
+    account_online_account_ids = fields.Many2many('account.online.account', string='Online Accounts', readonly=True,
+        help="Accounts to synchronize, leave empty to synchronize every account of the link")
+    company_id = fields.Many2one('res.company', related='account_online_link_id.company_id')
+    user_id = fields.Many2one('res.users', readonly=True, default=lambda self: self.env.user,
+        help="User that will receive the result of the synchronization")
+    notified_user_ids = fields.Many2many('res.users', string='Notified Users', readonly=True,
+        help="Other users waiting for the result of the synchronization")
+    refresh = fields.Boolean(default=True, readonly=True, help="Ask the provider to refresh the accounts before fetching transactions")
+    show_transactions = fields.Boolean(default=True, readonly=True, help="Propose to open the fetched transactions once the job is done")
+    state = fields.Selection([('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')],
+        default='pending', required=True, readonly=True, index=True)
+    message = fields.Text(readonly=True)
+    date_planned = fields.Datetime(readonly=True, index=True, default=fields.Datetime.now,
+        help="Date from which the job can be processed, postponed while the requests for the link keep coming")
+    date_start = fields.Datetime(readonly=True, help="Date at which the job started running")
+
+    @api.model
+    def _enqueue(self, link, accounts=False, refresh=True, show_transactions=True, delay=0):
+        '''
+        Queue a synchronization of the given link, merging it with a job that is still waiting for the same link.
+        A job already running may have fetched the transactions before the ones the request is about, a new job
+        is queued after it instead.
+        :param link: The account.online.link to synchronize.
+        :param accounts: The account.online.account to synchronize, False for all the accounts of the link.
+        :param delay: Number of seconds to wait before processing the job, to merge the requests coming in bursts.
+                      Each delayed request merged in the job postpones it, while a request without delay brings it forward.
+        :return: The pending job.
+        '''
+        link.ensure_one()
+        user = self.env.user
+        date_planned = fields.Datetime.now() + relativedelta(seconds=delay)
+        # Any user allowed to synchronize a link may queue a job for it
+        self = self.sudo()
+        job = self.search([('account_online_link_id', '=', link.id), ('state', '=', 'pending')], limit=1)
+        if job:
+            vals = {
+                'refresh': job.refresh or refresh,
+                'show_transactions': job.show_transactions or show_transactions,
+                'date_planned': max(job.date_planned, date_planned) if delay else date_planned,
+            }
+            if job.user_id != user:
+                vals['notified_user_ids'] = [(4, user.id)]
+            # An empty set of accounts means that the whole link has to be synchronized
+            if job.account_online_account_ids and accounts:
+                vals['account_online_account_ids'] = [(4, account.id) for account in accounts]
+            else:
+                vals['account_online_account_ids'] = [(5, 0, 0)]
+            job.write(vals)
+        else:
+            job = self.create({
+                'account_online_link_id': link.id,
+                'user_id': user.id,
+                'account_online_account_ids': [(6, 0, accounts.ids if accounts else [])],
+                'refresh': refresh,
+                'show_transactions': show_transactions,
+                'date_planned': date_planned,
+            })
+        self.env.ref('account_online_synchronization.online_sync_job_cron')._trigger(job.date_planned if delay else None)
+        return job
+
+    @api.model
+    def _cron_process_sync_jobs(self):
+        self._fail_lost_jobs()
+        # Stop before the worker is killed, the next run goes on with the jobs left
+        budget = self.env['account.journal']._get_online_sync_cron_budget()
+        start = time.time()
+        processed = 0
+        while True:
+            job = self.search([('state', '=', 'pending'), ('date_planned', '<=', fields.Datetime.now())], limit=1)
+            if not job:
+                break
+            estimate = job.account_online_link_id._get_sync_staleness_order()[0][1]
+            if budget and processed and time.time() - start + estimate > budget:
+                _logger.info('Online sync: time budget of the cron exhausted, queued synchronizations left for the next run')
+                self.env.ref('account_online_synchronization.online_sync_job_cron')._trigger()
+                break
+            job._process()
+            processed += 1
+
+    @api.model
+    def _fail_lost_jobs(self):
+        '''
+        A job is left running when its worker is killed in the middle of the synchronization. Fail the ones running
+        for longer than the workers are allowed to, so that their users know and can synchronize again.
+        '''
+        limit = self._get_running_time_limit()
+        jobs = self.search([('state', '=', 'running'), ('date_start', '<', fields.Datetime.now() - relativedelta(seconds=limit))])
+        if not jobs:
+            return
+        _logger.warning('Online sync: queued synchronizations %s interrupted', jobs.ids)
+        jobs.write({'state': 'failed', 'message': _('The synchronization was interrupted, please try again.')})
+        self.env.cr.commit()
+        for job in jobs:
+            job._notify_user('failed', message=job.message)
+
+    @api.model
+    def _get_running_time_limit(self):
+        '''
+        :return: The number of seconds after which a running job has been lost with its worker, which is the
+        real time limit of the cron workers, or an hour if they are not limited.
+        '''
+        limit = config.get('limit_time_real_cron', -1)
+        if limit is None or limit < 0:
+            limit = config.get('limit_time_real', 0)
+        return limit if limit and limit > 0 else 3600
+
+    def _process(self):
+        self.ensure_one()
+        # Commit the running state first so that it does not get lost when the synchronization
+        # rollbacks the transaction to log an error on the link.
+        self.write({'state': 'running', 'date_start': fields.Datetime.now()})
+        self.env.cr.commit()
+        link = self.account_online_link_id.with_user(self.user_id).with_company(self.company_id).with_context(
+            online_sync_job_id=self.id,
+            dont_show_transactions=not self.show_transactions,
+        )
+        self._notify_user('started')
+        try:
+            with link._lock_synchronization() as locked:
+                if locked:
+                    action = link._fetch_transactions_locked(refresh=self.refresh, accounts=self.account_online_account_ids or False)
+        except Exception as e:
+            self.env.cr.rollback()
+            if not isinstance(e, UserError):
+                _logger.exception('Online sync: background synchronization of link %s failed', self.account_online_link_id.id)
+            self.write({'state': 'failed', 'message': str(e)})
+            self.env.cr.commit()
+            self._notify_user('failed', message=str(e))
+            return
+        if not locked:
+            # Another worker is already synchronizing the link, it fetches the same transactions
+            self.write({'state': 'done', 'message': _('The link was already being synchronized.')})
+            self.env.cr.commit()
+            self._notify_user('busy', message=self.message)
+            return
+        self.state = 'done'
+        self.env.cr.commit()
+        self._notify_user('done', action=action)
+
+    def _notify_progress(self, done, total):
+        self.ensure_one()
+        self._notify_user('progress', done=done, total=total)
+
+    def _notify_user(self, status, **payload):
+        self.ensure_one()
+        users = self.user_id | self.notified_user_ids
+        if not users:
+            return
+        message = dict(payload, type='account_online_sync', status=status, job_id=self.id, link_name=self.account_online_link_id.name)
+        # Use a separate cursor so that the users are notified right away, whatever happens to the
+        # transaction of the synchronization itself.
+        with self.pool.cursor() as cr:
+            self.env(cr=cr)['bus.bus'].sendmany([((self._cr.dbname, 'res.partner', user.partner_id.id), message) for user in users])
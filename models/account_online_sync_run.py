@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+
+from odoo import api, fields, models, tools
+
+PHASES = ('refresh', 'download', 'dedupe', 'statement', 'posting', 'throttle')
+
+
+class AccountOnlineSyncRun(models.Model):
+    _name = 'account.online.sync.run'
+    _description = 'Online synchronization run'
+    _order = 'date_start desc, id desc'
+    # There is one record per link and per synchronization, keep the rows as small as possible
+    _log_access = False
+
+    account_online_link_id = fields.Many2one('account.online.link', string='Link', required=True, readonly=True, ondelete='cascade')
+    company_id = fields.Many2one('res.company', related='account_online_link_id.company_id')
+    institution = fields.Char(related='account_online_link_id.name')
+    state = fields.Selection([('done', 'Done'), ('failed', 'Failed')], required=True, readonly=True)
+    message = fields.Text(readonly=True)
+    cron = fields.Boolean(readonly=True, help="Whether the synchronization has been triggered by the scheduled action")
+    batch = fields.Char(readonly=True, index=True, help="Identifier stamped on the statement lines created by the synchronization")
+
+    date_start = fields.Datetime(required=True, readonly=True)
+    date_end = fields.Datetime(readonly=True)
+    duration = fields.Float("Duration (s)", readonly=True, group_operator='avg')
+    refresh_duration = fields.Float("Refresh (s)", readonly=True, group_operator='avg')
+    download_duration = fields.Float("Download (s)", readonly=True, group_operator='avg')
+    dedupe_duration = fields.Float("Dedupe (s)", readonly=True, group_operator='avg')
+    statement_duration = fields.Float("Statement creation (s)", readonly=True, group_operator='avg')
+    posting_duration = fields.Float("Posting (s)", readonly=True, group_operator='avg')
+    throttle_duration = fields.Float("Throttled (s)", readonly=True, group_operator='avg', help="Time spent waiting for the rate limits")
+    network_duration = fields.Float("Network (s)", readonly=True, group_operator='avg', help="Time spent waiting for the proxy")
+
+    request_count = fields.Integer("Proxy calls", readonly=True)
+    pages_fetched = fields.Integer(readonly=True)
+    transactions_received = fields.Integer(readonly=True)
+    transactions_inserted = fields.Integer(readonly=True)
+    bytes_transferred = fields.Integer(readonly=True)
+
+    def init(self):
+        tools.create_index(self._cr, 'account_online_sync_run_link_date_index', self._table, ['account_online_link_id', 'date_start DESC'])
+        tools.create_index(self._cr, 'account_online_sync_run_date_index', self._table, ['date_start DESC'])
+
+    @api.model
+    def _record_run(self, link, tracer, error=None, batch=None):
+        '''
+        Save the statistics collected by a tracer during a synchronization of a link.
+        :param link: The synchronized account.online.link.
+        :param tracer: The sync_tracing.SyncTracer that observed the synchronization.
+        :param error: The message of the error that stopped the synchronization, if any.
+        :param batch: The identifier stamped on the statement lines created by the synchronization.
+        '''
+        vals = {
+            'account_online_link_id': link.id,
+            'state': 'failed' if error else 'done',
+            'message': error or False,
+            'cron': bool(self.env.context.get('cron')),
+            'batch': batch,
+            'date_start': datetime.utcfromtimestamp(tracer.start_time),
+            'date_end': datetime.utcfromtimestamp(tracer.end_time),
+            'duration': tracer.end_time - tracer.start_time,
+            'network_duration': sum(request['duration'] for request in tracer.requests),
+            'request_count': len(tracer.requests),
+            'pages_fetched': len([request for request in tracer.requests if request['url'] == '/proxy/v1/transactions']),
+            'transactions_received': tracer.counters.get('transactions_received', 0),
+            'transactions_inserted': tracer.counters.get('transactions_inserted', 0),
+            'bytes_transferred': sum(request.get('size', 0) for request in tracer.requests),
+        }
+        for phase in PHASES:
+            vals['%s_duration' % phase] = tracer.phases.get(phase, {}).get('duration', 0.0)
+        return self.sudo().create(vals)
+
+    def action_open_statement_lines(self):
+        self.ensure_one()
+        return self.account_online_link_id.with_context(online_sync_batch=self.batch)._show_fetched_transactions_action(
+            self.env['account.bank.statement.line'])
+
+    @api.autovacuum
+    def _gc_sync_runs(self):
+        days = int(self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.sync_run_retention_days', 90))
+        limit_date = fields.Datetime.now() - relativedelta(days=days)
+        self.sudo().search([('date_start', '<', limit_date)]).unlink()
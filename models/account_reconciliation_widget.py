@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+from odoo import api, models
+
+
+class AccountReconciliation(models.AbstractModel):
+    _inherit = 'account.reconciliation.widget'
+
+    @api.model
+    def get_bank_statement_data(self, bank_statement_line_ids, srch_domain=[]):
+        # The action opened after a synchronization only holds the handle of the batch of the created
+        # lines instead of their ids, read them back here to keep big batches out of the client context.
+        # Only the first page of the batch is matched right away, see get_online_sync_batch_page.
+        batch = self.env.context.get('online_sync_batch')
+        if batch and not bank_statement_line_ids:
+            domain = self._get_online_sync_batch_domain(batch) + list(srch_domain or [])
+            StatementLine = self.env['account.bank.statement.line']
+            total = StatementLine.search_count(domain)
+            page = StatementLine.search(domain, order='id', limit=self._get_online_sync_page_size())
+            results = super(AccountReconciliation, self).get_bank_statement_data(page.ids, srch_domain=srch_domain)
+            results.update({
+                'online_sync_total': total,
+                'online_sync_last_id': page[-1:].id or 0,
+            })
+            return results
+        return super(AccountReconciliation, self).get_bank_statement_data(bank_statement_line_ids, srch_domain=srch_domain)
+
+    @api.model
+    def get_online_sync_batch_page(self, last_id, limit=None, excluded_ids=None, srch_domain=[]):
+        ''' Get the next page of the lines of the synchronization batch given in the context.
+            :param last_id: The id of the last line of the previous page, the lines being paged by id so that
+                            the lines reconciled meanwhile do not shift the pages.
+            :param limit: The number of lines of the page, the configured page size by default.
+            :param excluded_ids: The ids of the journal items already proposed on the previous pages.
+            :return: The data of the lines, as given by get_bank_statement_line_data, and the id of the last one.
+        '''
+        domain = self._get_online_sync_batch_domain(self.env.context.get('online_sync_batch')) + list(srch_domain or [])
+        page = self.env['account.bank.statement.line'].search(
+            domain + [('id', '>', last_id)], order='id', limit=limit or self._get_online_sync_page_size())
+        results = self.get_bank_statement_line_data(page.ids, excluded_ids=excluded_ids) if page else {'lines': []}
+        results['online_sync_last_id'] = page[-1:].id or last_id
+        return results
+
+    @api.model
+    def _get_online_sync_batch_domain(self, batch):
+        return [('online_sync_batch', '=', batch), ('is_reconciled', '=', False)]
+
+    @api.model
+    def _get_online_sync_page_size(self):
+        return int(self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.reconciliation_page_size', 50))
+
+    @api.model
+    def get_bank_statement_line_data(self, st_line_ids, excluded_ids=None):
+        # Use the propositions computed in the background after the synchronization, see _apply_rules
+        return super(AccountReconciliation, self.with_context(online_sync_matching_cache=True)).get_bank_statement_line_data(
+            st_line_ids, excluded_ids=excluded_ids)
+
+
+class AccountReconcileModel(models.Model):
+    _inherit = 'account.reconcile.model'
+
+    def _apply_rules(self, st_lines, excluded_ids=None, partner_map=None):
+        if not self.env.context.get('online_sync_matching_cache'):
+            return super(AccountReconcileModel, self)._apply_rules(st_lines, excluded_ids=excluded_ids, partner_map=partner_map)
+        results = {}
+        for line in st_lines.filtered(lambda l: l.online_match_status in ('proposition', 'write_off') and not l.online_sync_to_match):
+            if not line._is_online_match_valid(self, excluded_ids=excluded_ids, partner_map=partner_map):
+                # The propositions are outdated, compute them again
+                continue
+            results[line.id] = {'aml_ids': line.online_match_aml_ids.ids}
+            if line.online_match_model_id:
+                results[line.id]['model'] = line.online_match_model_id
+            if line.online_match_status == 'write_off':
+                results[line.id]['status'] = 'write_off'
+        remaining_lines = st_lines.filtered(lambda l: l.id not in results)
+        if remaining_lines:
+            results.update(super(AccountReconcileModel, self)._apply_rules(remaining_lines, excluded_ids=excluded_ids, partner_map=partner_map))
+        return results
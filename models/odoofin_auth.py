@@ -20,11 +20,24 @@ class OdooFinAuth(requests.auth.AuthBase):
         self.refresh_token = record and record.refresh_token or False
         self.client_id = record and record.client_id or False
 
+    def get_signature(self, timestamp, path, query_params, body):
+        ''' :return: The base64 encoded signature of a request, also used to verify the requests sent by OdooFin. '''
+        # craft the message (timestamp|url path|client_id|access_token|query params|body content)
+        message = '%s|%s|%s|%s|%s|%s' % (
+            timestamp,  # timestamp
+            path,  # url path
+            self.client_id,
+            self.access_token,
+            json.dumps(query_params, sort_keys=True),  # url query params sorted by key
+            json.dumps(body, sort_keys=True))  # http request body
+
+        h = hmac.new(base64.b64decode(self.refresh_token), message.encode('utf-8'), digestmod=hashlib.sha256)
+        return base64.b64encode(h.digest())
+
     def __call__(self, request):
         # We don't sign request that still don't have a client_id/refresh_token
         if not self.client_id or not self.refresh_token:
             return request
-        # craft the message (timestamp|url path|client_id|access_token|query params|body content)
         msg_timestamp = int(time.time())
         parsed_url = werkzeug.urls.url_parse(request.path_url)
 
@@ -33,20 +46,12 @@ class OdooFinAuth(requests.auth.AuthBase):
             body = body.decode('utf-8')
         body = json.loads(body)
 
-        message = '%s|%s|%s|%s|%s|%s' % (
-            msg_timestamp,  # timestamp
-            parsed_url.path,  # url path
-            self.client_id,
-            self.access_token,
-            json.dumps(werkzeug.urls.url_decode(parsed_url.query), sort_keys=True),  # url query params sorted by key
-            json.dumps(body, sort_keys=True))  # http request body
-
-        h = hmac.new(base64.b64decode(self.refresh_token), message.encode('utf-8'), digestmod=hashlib.sha256)
+        signature = self.get_signature(msg_timestamp, parsed_url.path, werkzeug.urls.url_decode(parsed_url.query), body)
 
         request.headers.update({
             'odoofin-client-id': self.client_id,
             'odoofin-access-token': self.access_token,
-            'odoofin-signature': base64.b64encode(h.digest()),
+            'odoofin-signature': signature,
             'odoofin-timestamp': msg_timestamp,
         })
         return request
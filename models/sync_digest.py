@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+@contextmanager
+def collecting(digest):
+    """ Collect what is logged on the links in the given digest instead of the chatter, e.g.:
+            with collecting(SyncDigest()) as digest:
+                link._fetch_transactions()
+            link._flush_sync_digest(digest)
+    """
+    previous = getattr(_local, 'digest', None)
+    _local.digest = digest
+    try:
+        yield digest
+    finally:
+        _local.digest = previous
+
+
+def current():
+    """ :return: The digest collecting the logs of the current thread, if any. """
+    return getattr(_local, 'digest', None)
+
+
+class SyncDigest(object):
+    """ Messages and state changes of the links, kept in memory until they are written at once. """
+    def __init__(self):
+        self.states = {}
+        self.messages = {}
+
+    def log(self, link_id, state=None, subject=None, message=None):
+        if state:
+            self.states[link_id] = state
+        if subject and message:
+            self.messages.setdefault(link_id, []).append((subject, message))
+
+    def get_state(self, link_id, default=None):
+        return self.states.get(link_id, default)
+
+    def pop(self, link_id):
+        """ :return: The state and the messages collected for the link, which are forgotten. """
+        return self.states.pop(link_id, None), self.messages.pop(link_id, [])
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from requests.exceptions import ConnectionError, Timeout
+
+_local = threading.local()
+
+RECORDING_VERSION = 1
+# Credentials and identifiers of the database, never kept in the recordings. They are replaced by False, which
+# a replay must not write on the link: the provider_data is only saved when given (see _handle_response) and the
+# tokens are not saved at all while replaying (see _get_access_token and _get_refresh_token).
+REDACTED_KEYS = ('provider_data', 'account_data', 'access_token', 'refresh_token', 'db_uuid')
+
+
+@contextmanager
+def recording(recorder):
+    """ Record the calls made to the proxy by the current thread in the given recorder, e.g.:
+            with recording(SyncRecorder()) as recorder:
+                link._fetch_transactions()
+            attachment_data = recorder.dumps()
+    """
+    previous = getattr(_local, 'recorder', None)
+    _local.recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _local.recorder = previous
+
+
+@contextmanager
+def replaying(replayer):
+    """ Answer the calls made to the proxy by the current thread with the responses of a recording, see SyncReplayer. """
+    previous = getattr(_local, 'replayer', None)
+    _local.replayer = replayer
+    try:
+        yield replayer
+    finally:
+        _local.replayer = previous
+
+
+def current_recorder():
+    """ :return: The recorder of the current thread, if any. """
+    return getattr(_local, 'recorder', None)
+
+
+def current_replayer():
+    """ :return: The replayer of the current thread, if any. """
+    return getattr(_local, 'replayer', None)
+
+
+def redact(value):
+    if isinstance(value, dict):
+        return {key: False if key in REDACTED_KEYS else redact(val) for key, val in value.items()}
+    if isinstance(value, list):
+        return [redact(val) for val in value]
+    return value
+
+
+def _get_call_key(url, data):
+    return url, (data or {}).get('account_id')
+
+
+class SyncRecorder(object):
+    """ Calls made to the proxy during a synchronization, in the order they have been handled, with their timings. """
+    def __init__(self):
+        self.start_time = time.time()
+        self.calls = []
+
+    def record(self, request, response):
+        """
+        :param request: The request prepared by AccountOnlineLink._prepare_odoo_fin_request.
+        :param response: The result of send_odoo_fin_request for that request.
+        """
+        exception = response.get('exception')
+        self.calls.append({
+            'url': request['url'],
+            'account_id': request['data'].get('account_id'),
+            'offset': time.time() - self.start_time,
+            'duration': response.get('duration', 0.0),
+            'status': response.get('status'),
+            'size': response.get('size', 0),
+            'request': redact(request['data']),
+            'response': redact(response.get('json')),
+            'exception': exception and (
+                'timeout' if isinstance(exception, Timeout) else
+                'connection' if isinstance(exception, ConnectionError) else
+                'invalid' if isinstance(exception, ValueError) else 'error'
+            ),
+        })
+
+    def dumps(self, **info):
+        return json.dumps(dict(info, version=RECORDING_VERSION, calls=self.calls), indent=1, sort_keys=True)
+
+
+class SyncReplayer(object):
+    """ Transport answering the calls to the proxy with the responses of a recording instead of reaching the proxy.
+        The responses are given back in order by endpoint and account, so that the replay does not depend on the
+        order the accounts are refreshed in.
+        :param data: The content of a recording, as given by SyncRecorder.dumps.
+        :param latency: Whether to wait for the recorded duration of the calls, to reproduce the timings of the proxy.
+    """
+    def __init__(self, data, latency=False):
+        recording = json.loads(data)
+        if recording.get('version') != RECORDING_VERSION:
+            raise ValueError('Unsupported version of synchronization recording: %s' % recording.get('version'))
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = {}
+        for call in recording['calls']:
+            self.calls.setdefault((call['url'], call['account_id']), []).append(call)
+        # online_identifier of the recorded accounts
+        self.accounts = {call['account_id'] for call in recording['calls'] if call['account_id']}
+
+    def send(self, request):
+        """ Same as send_odoo_fin_request, with the next recorded response of the endpoint. """
+        key = _get_call_key(request['url'], request['data'])
+        with self.lock:
+            calls = self.calls.get(key)
+            call = calls.pop(0) if calls else None
+        if call is None:
+            return {'duration': 0.0, 'exception': ValueError('No recorded response left for %s of account %s' % key)}
+        if self.latency:
+            time.sleep(call['duration'])
+        response = {'duration': call['duration']}
+        if call['status']:
+            response.update(status=call['status'], size=call['size'])
+        if call['exception']:
+            response['exception'] = {
+                'timeout': Timeout, 'connection': ConnectionError, 'invalid': ValueError,
+            }.get(call['exception'], Exception)('Recorded %s error' % call['exception'])
+        else:
+            response['json'] = call['response']
+        return response
+
+    def remaining(self):
+        """ :return: The number of recorded calls that have not been replayed. """
+        return sum(len(calls) for calls in self.calls.values())
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+import cProfile
+import io
+import marshal
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+def _active_tracers():
+    if not hasattr(_local, 'tracers'):
+        _local.tracers = []
+    return _local.tracers
+
+
+@contextmanager
+def tracing(tracer):
+    """ Make the given tracer observe everything that happens in the current thread, e.g.:
+            with tracing(SyncProfiler()) as profiler:
+                link._fetch_transactions()
+    """
+    tracers = _active_tracers()
+    tracers.append(tracer)
+    tracer.start()
+    try:
+        yield tracer
+    finally:
+        tracer.stop()
+        tracers.remove(tracer)
+
+
+@contextmanager
+def phase(name):
+    """ Delimit a phase of the synchronization (refresh, download, ...) for the active tracers. """
+    tracers = list(_active_tracers())
+    for tracer in tracers:
+        tracer.enter_phase(name)
+    try:
+        yield
+    finally:
+        for tracer in reversed(tracers):
+            tracer.exit_phase(name)
+
+
+def record_request(url, duration, **info):
+    """ Report a call made to the proxy to the active tracers. """
+    for tracer in _active_tracers():
+        tracer.record_request(url, duration, **info)
+
+
+def count(name, value=1):
+    """ Increment a counter (transactions received, ...) of the active tracers. """
+    for tracer in _active_tracers():
+        tracer.count(name, value)
+
+
+class SyncTracer(object):
+    """ Base class of the objects observing a synchronization, see tracing().
+        The time and the SQL queries are accounted to the innermost phase only, so that the
+        time spent posting statements is not counted twice in the statement creation phase.
+    """
+    def __init__(self):
+        self.phases = {}
+        self.requests = []
+        self.counters = {}
+        self.start_time = self.end_time = None
+        self._stack = []
+        self._mark = None
+        self._added_counters = False
+
+    def start(self):
+        thread = threading.current_thread()
+        # The cursor only counts the queries of the threads having those attributes
+        if not hasattr(thread, 'query_count'):
+            thread.query_count = 0
+            thread.query_time = 0
+            self._added_counters = True
+        self.start_time = time.time()
+        self._mark = self._snapshot()
+
+    def stop(self):
+        self._account()
+        self.end_time = time.time()
+        if self._added_counters:
+            # Leave the thread as it was, so that its queries are not counted once the synchronization is done
+            thread = threading.current_thread()
+            for attr in ('query_count', 'query_time'):
+                if hasattr(thread, attr):
+                    delattr(thread, attr)
+            self._added_counters = False
+
+    def _snapshot(self):
+        thread = threading.current_thread()
+        return time.time(), getattr(thread, 'query_count', 0), getattr(thread, 'query_time', 0)
+
+    def _account(self):
+        now = self._snapshot()
+        if self._stack:
+            stats = self.phases[self._stack[-1]]
+            stats['duration'] += now[0] - self._mark[0]
+            stats['queries'] += now[1] - self._mark[1]
+            stats['query_time'] += now[2] - self._mark[2]
+        self._mark = now
+
+    def enter_phase(self, name):
+        self._account()
+        self._stack.append(name)
+        stats = self.phases.setdefault(name, {'calls': 0, 'duration': 0.0, 'queries': 0, 'query_time': 0.0})
+        stats['calls'] += 1
+
+    def exit_phase(self, name):
+        self._account()
+        self._stack.pop()
+
+    def record_request(self, url, duration, **info):
+        self.requests.append(dict(info, url=url, duration=duration, phase=self._stack and self._stack[-1] or None))
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+
+class SyncProfiler(SyncTracer):
+    """ Tracer also collecting the python stacks of the synchronization with cProfile. """
+    def __init__(self):
+        super(SyncProfiler, self).__init__()
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        super(SyncProfiler, self).start()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        super(SyncProfiler, self).stop()
+
+    def get_stats_dump(self):
+        """ :return: The raw cProfile statistics, readable with pstats or snakeviz. """
+        # pstats can only dump into a file name, marshal the stats the same way it does
+        return marshal.dumps(pstats.Stats(self.profile).stats)
+
+    def get_report(self, limit=50):
+        """ :return: A human readable report of the phases, the proxy calls and the python stacks. """
+        lines = ['Total duration: %.3fs' % ((self.end_time or time.time()) - self.start_time), '']
+        lines.append('%-20s %8s %12s %10s %14s' % ('Phase', 'Calls', 'Duration (s)', 'Queries', 'SQL time (s)'))
+        for name, stats in self.phases.items():
+            lines.append('%-20s %8d %12.3f %10d %14.3f' % (name, stats['calls'], stats['duration'], stats['queries'], stats['query_time']))
+        lines += ['', 'Counters: %s' % ', '.join('%s=%s' % item for item in self.counters.items())]
+        lines += ['', 'Proxy calls: %d, %.3fs' % (len(self.requests), sum(r['duration'] for r in self.requests))]
+        for request in self.requests:
+            lines.append('%-30s %-12s %8.3fs %s' % (request['url'], request['phase'] or '', request['duration'], request.get('status') or ''))
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats('cumulative').print_stats(limit)
+        lines += ['', stream.getvalue()]
+        return '\n'.join(lines)
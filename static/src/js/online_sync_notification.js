@@ -0,0 +1,73 @@
+odoo.define('account_online_synchronization.online_sync_notification', function(require) {
+"use strict";
+
+    var core = require('web.core');
+    var WebClient = require('web.WebClient');
+
+    var _t = core._t;
+
+    WebClient.include({
+        start: function () {
+            this.call('bus_service', 'onNotification', this, this._onOnlineSyncNotification);
+            return this._super.apply(this, arguments);
+        },
+
+        /**
+         * Display the progress and the result of the synchronizations running in the background.
+         */
+        _onOnlineSyncNotification: function (notifications) {
+            var self = this;
+            _.each(notifications, function (notification) {
+                var message = notification[1];
+                if (!message || message.type !== 'account_online_sync') {
+                    return;
+                }
+                var title = message.link_name || _t('Online Synchronization');
+                switch (message.status) {
+                    case 'progress':
+                        self.displayNotification({
+                            title: title,
+                            message: _.str.sprintf(_t('%s / %s accounts synchronized'), message.done, message.total),
+                            type: 'info',
+                        });
+                        break;
+                    case 'busy':
+                        self.displayNotification({
+                            title: title,
+                            message: message.message,
+                            type: 'warning',
+                        });
+                        break;
+                    case 'failed':
+                        self.displayNotification({
+                            title: title,
+                            message: message.message,
+                            type: 'danger',
+                            sticky: true,
+                        });
+                        break;
+                    case 'done':
+                        var params = {
+                            title: title,
+                            message: _t('The synchronization is done.'),
+                            type: 'success',
+                            sticky: !!message.action,
+                        };
+                        if (message.action) {
+                            params.buttons = [{
+                                text: _t('Show'),
+                                primary: true,
+                                click: function () {
+                                    return self.do_action(message.action);
+                                },
+                            }];
+                        }
+                        self.displayNotification(params);
+                        break;
+                    default:
+                        return;
+                }
+            });
+        },
+    });
+});
@@ -0,0 +1,82 @@
+odoo.define('account_online_synchronization.ReconciliationModel', function (require) {
+"use strict";
+
+    var ReconciliationModel = require('account.ReconciliationModel');
+
+    ReconciliationModel.StatementModel.include({
+        /**
+         * The action opened after a synchronization only gives the batch of the fetched transactions,
+         * the lines of the batch are read by the server (see get_bank_statement_data). Do not fall back
+         * on all the lines of the journal when the ids of the lines are not in the context.
+         *
+         * @override
+         */
+        load: function (context) {
+            if (context && context.online_sync_batch && !context.statement_line_ids) {
+                context = _.extend({}, context, {statement_line_ids: []});
+            }
+            return this._super(context);
+        },
+        /**
+         * Only the first page of a synchronization batch is given by get_bank_statement_data, keep track
+         * of the lines left on the server.
+         *
+         * @override
+         */
+        reload: function () {
+            var self = this;
+            return this._super.apply(this, arguments).then(function (result) {
+                self.onlineSyncTotal = self.statement && self.statement.online_sync_total || 0;
+                self.onlineSyncLastId = self.statement && self.statement.online_sync_last_id || 0;
+                return result;
+            });
+        },
+        /**
+         * Once the lines of the pages already received are displayed, get the next page of the
+         * synchronization batch from the server.
+         *
+         * @override
+         */
+        loadMore: function (qty) {
+            var self = this;
+            if (!this.onlineSyncLastId || this.pagerIndex < _.size(this.lines) || _.size(this.lines) >= this.onlineSyncTotal) {
+                return this._super.apply(this, arguments);
+            }
+            return this._rpc({
+                model: 'account.reconciliation.widget',
+                method: 'get_online_sync_batch_page',
+                kwargs: {
+                    last_id: this.onlineSyncLastId,
+                    limit: qty,
+                    excluded_ids: this._getExcludedIds(),
+                    srch_domain: this.domain,
+                },
+                context: this.context,
+            }).then(function (result) {
+                if (!result.lines.length) {
+                    // The remaining lines have been reconciled meanwhile
+                    self.onlineSyncTotal = _.size(self.lines);
+                    return;
+                }
+                self.onlineSyncLastId = result.online_sync_last_id;
+                _.each(result.lines, function (res) {
+                    var handle = _.uniqueId('rline');
+                    self.lines[handle] = {
+                        id: res.st_line.id,
+                        partner_id: res.st_line.partner_id,
+                        handle: handle,
+                        reconciled: false,
+                        mode: 'inactive',
+                        mv_lines_match_rp: [],
+                        mv_lines_match_other: [],
+                        filter_match: "",
+                        reconcileModels: self.reconcileModels,
+                        reconciliation_proposition: [],
+                    };
+                });
+                self.pagerIndex = _.size(self.lines);
+                return self._formatLine(result.lines);
+            });
+        },
+    });
+});
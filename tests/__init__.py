@@ -1,3 +1,7 @@
 # -*- encoding: utf-8 -*-
 
 from . import test_online_sync_creation_statement
+from . import test_online_sync_fetch
+from . import test_online_sync_load
+from . import test_online_sync_notification
+from . import test_online_sync_rate_limit
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import base64
+import datetime
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandInOdooFinProxy(object):
+    """ Local stand-in of the Odoo Fin proxy, serving generated accounts and transactions.
+        e.g.:
+            with StandInOdooFinProxy(page_size=50, latency=0.05) as proxy:
+                # Make _get_proxy_url return proxy.url + url
+                ...
+        :param accounts: Number of accounts listed by /accounts for every link.
+        :param transactions: Number of transactions of every account.
+        :param page_size: Number of transactions or accounts sent per page.
+        :param refresh_polls: Number of times /refresh has to be polled before the account is refreshed.
+        :param latency: Time spent by the proxy on every call, either a number of seconds or a dict of
+                        seconds by endpoint ('/proxy/v1/transactions', ...).
+        :param jitter: Random part of the latency, in percent of the latency.
+        :param errors: Probability of every call to fail, by error: 101 (access token expired), 102 (refresh
+                       token expired), 300 (the user has to reconnect the link), 'invalid' (the response is
+                       not json), 'timeout' (the proxy answers after the timeout of the client).
+        :param seed: Seed of the generation of the transactions and of the errors, for reproducible runs.
+    """
+    def __init__(self, accounts=1, transactions=100, page_size=50, refresh_polls=1, latency=0.0, jitter=0,
+                 errors=None, timeout=None, seed=0):
+        self.accounts = accounts
+        self.transactions = transactions
+        self.page_size = page_size
+        self.refresh_polls = refresh_polls
+        self.latency = latency
+        self.jitter = jitter
+        self.errors = errors or {}
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = []
+        self.refreshes = {}
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % self.server.server_address[:2]
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                status, payload = proxy.handle(self.path, json.loads(body or '{}'))
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    #####################
+    # Request handling  #
+    #####################
+
+    def _draw(self):
+        with self.lock:
+            return self.random.random()
+
+    def _sleep(self, path):
+        latency = self.latency.get(path, 0.0) if isinstance(self.latency, dict) else self.latency
+        if latency and self.jitter:
+            latency *= 1 + (self._draw() * 2 - 1) * self.jitter / 100.0
+        if latency:
+            time.sleep(latency)
+
+    def _error(self, code, message, data=None):
+        return {'error': {'code': code, 'message': message, 'data': dict(data or {}, message=message)}}
+
+    def handle(self, path, data):
+        start = time.time()
+        self._sleep(path)
+        response = self._inject_error(path)
+        if response is None:
+            method = getattr(self, '_%s' % path.rsplit('/', 1)[-1], None)
+            response = {'result': method(data)} if method else self._error(404, 'Unknown endpoint %s' % path)
+        if response == 'invalid':
+            payload = b'<html>Bad Gateway</html>'
+        else:
+            payload = json.dumps(dict(response, jsonrpc='2.0', id=None)).encode('utf-8')
+        with self.lock:
+            self.calls.append({'path': path, 'duration': time.time() - start, 'error': response.get('error', {}).get('code') if isinstance(response, dict) else response})
+        return 200, payload
+
+    def _inject_error(self, path):
+        # Token calls never fail, otherwise the errors would loop
+        if path in ('/proxy/v1/get_access_token', '/proxy/v1/renew_token'):
+            return None
+        for error, probability in self.errors.items():
+            if self._draw() >= probability:
+                continue
+            if error == 101:
+                return self._error(101, 'Access token expired')
+            if error == 102:
+                return self._error(102, 'Refresh token expired')
+            if error == 300 and path == '/proxy/v1/refresh':
+                return self._error(300, 'Redirect', data={'mode': 'reconnect'})
+            if error == 'invalid':
+                return 'invalid'
+            if error == 'timeout' and self.timeout:
+                time.sleep(self.timeout + 0.1)
+        return None
+
+    def _get_access_token(self, data):
+        return {'access_token': 'access-%s' % self._draw()}
+
+    def _renew_token(self, data):
+        return {'refresh_token': base64.b64encode(b'refresh-token').decode()}
+
+    def _accounts(self, data):
+        offset = (data.get('next_data') or {}).get('offset', 0)
+        identifiers = ['ACC-%s' % i for i in range(self.accounts)]
+        page = identifiers[offset:offset + self.page_size]
+        result = {'accounts': [{'online_identifier': identifier, 'name': 'Account %s' % identifier, 'balance': 0.0} for identifier in page]}
+        if offset + self.page_size < len(identifiers):
+            result['next_data'] = {'offset': offset + self.page_size}
+        return result
+
+    def _refresh(self, data):
+        account = data.get('account_id')
+        with self.lock:
+            polls = self.refreshes[account] = self.refreshes.get(account, 0) + 1
+        if polls < self.refresh_polls:
+            return {'next_data': {'poll': polls}}
+        with self.lock:
+            self.refreshes.pop(account, None)
+        return {}
+
+    def _transactions(self, data):
+        account = data.get('account_id')
+        offset = (data.get('next_data') or {}).get('offset', 0)
+        today = datetime.date.today()
+        page = [{
+            'online_transaction_identifier': '%s-%s' % (account, i),
+            'date': (today - datetime.timedelta(days=i % 15)).strftime('%Y-%m-%d'),
+            'payment_ref': 'Transaction %s of %s' % (i, account),
+            'amount': (i % 7 - 3) * 10.0 or 5.0,
+        } for i in range(offset, min(offset + self.page_size, self.transactions))]
+        result = {
+            'transactions': page,
+            'balance': sum((i % 7 - 3) * 10.0 or 5.0 for i in range(self.transactions)),
+        }
+        if offset + self.page_size < self.transactions:
+            result['next_data'] = {'offset': offset + self.page_size}
+        return result
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+from unittest.mock import patch
+
 from odoo.addons.account.tests.common import AccountTestInvoicingCommon
 from odoo.tests import tagged
 from odoo import fields
@@ -608,3 +610,114 @@ class TestSynchStatementCreation(AccountTestInvoicingCommon):
         # Validate and check that partner has no vendor_name set
         self.confirm_bank_statement(created_bnk_stmt)
         self.assertEqual(agrolait.online_partner_information, False)
+
+    def test_deferred_posting(self):
+        self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.deferred_posting', 'True')
+        transactions = self.create_transactions(['2016-01-01', '2016-01-03'])
+        self.online_account.balance = 1000
+        self.bnk_stmt._online_sync_bank_statement(transactions, self.online_account)
+        created_bnk_stmt = self.bnk_stmt.search([('journal_id', '=', self.bank_journal.id)], order='date asc')
+        # The opening statement and the synchronized one are left open until the posting cron runs
+        self.assertRecordValues(created_bnk_stmt, [
+            {'state': 'open', 'online_sync_to_post': True, 'balance_end_real': 980.0},
+            {'state': 'open', 'online_sync_to_post': True, 'balance_end_real': 1000.0},
+        ])
+        with patch.object(self.env.cr, 'commit'):
+            self.bnk_stmt._cron_post_online_sync_statements()
+        self.assertRecordValues(created_bnk_stmt, [
+            {'state': 'posted', 'online_sync_to_post': False, 'balance_end_real': 980.0},
+            {'state': 'posted', 'online_sync_to_post': False, 'balance_end_real': 1000.0},
+        ])
+
+    def test_suggest_partner(self):
+        if not self.env['res.partner']._has_trigram_index():
+            self.skipTest("The pg_trgm extension is not available")
+        amazon = self.env['res.partner'].create({'name': 'Amazon EU Sarl'})
+        landlord = self.env['res.partner'].create({'name': 'Landlord', 'bank_ids': [(0, 0, {'acc_number': 'BE71 0961 2345 6769'})]})
+        transactions = self.create_transactions(['2016-01-01', '2016-01-01', '2016-01-01', '2016-01-01'])
+        transactions[0]['payment_ref'] = 'AMAZON EU SARL 20160101'
+        transactions[1]['payment_ref'] = 'Rent BE71096123456769'
+        transactions[2]['payment_ref'] = 'Unknown merchant'
+        transactions[3]['payment_ref'] = 'Amazon EU Sarl Lux'
+        self.online_account.balance = 40
+        self.bnk_stmt._online_sync_bank_statement(transactions, self.online_account)
+        lines = self.env['account.bank.statement.line'].search([('journal_id', '=', self.bank_journal.id)], order='id')
+        self.assertRecordValues(lines, [
+            {'partner_id': amazon.id, 'online_partner_suggestion_id': amazon.id, 'online_partner_confidence': 1.0},
+            {'partner_id': landlord.id, 'online_partner_suggestion_id': landlord.id, 'online_partner_confidence': 1.0},
+            {'partner_id': False, 'online_partner_suggestion_id': False, 'online_partner_confidence': 0.0},
+            # A fuzzy match is only a suggestion
+            {'partner_id': False, 'online_partner_suggestion_id': amazon.id},
+        ])
+        self.assertTrue(0.6 <= lines[3].online_partner_confidence < 1.0)
+
+    def test_precompute_matching(self):
+        self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.precompute_matching', 'True')
+        invoice = self.init_invoice('out_invoice', partner=self.partner_a, amounts=[50.0], post=True)
+        transactions = self.create_transaction_partner(date='2016-01-01', partner_id=self.partner_a.id)
+        transactions[0]['payment_ref'] = invoice.name
+        self.online_account.balance = 50
+        self.bnk_stmt._online_sync_bank_statement(transactions, self.online_account)
+        line = self.env['account.bank.statement.line'].search([('journal_id', '=', self.bank_journal.id)])
+        self.assertTrue(line.online_sync_to_match)
+
+        with patch.object(self.env.cr, 'commit'):
+            self.env['account.bank.statement.line']._cron_precompute_online_sync_matching()
+        receivable_line = invoice.line_ids.filtered(lambda l: l.account_id.user_type_id.type == 'receivable')
+        self.assertRecordValues(line, [{
+            'online_sync_to_match': False,
+            'online_match_status': 'proposition',
+            'online_match_aml_ids': receivable_line.ids,
+        }])
+        # The widget gets the precomputed proposition
+        data = self.env['account.reconciliation.widget'].get_bank_statement_line_data(line.ids)
+        self.assertEqual([aml['id'] for aml in data['lines'][0]['reconciliation_proposition']], receivable_line.ids)
+        self.assertEqual(line.online_match_partner_id, self.partner_a)
+        # The propositions are computed again when the widget finds another partner or when they are taken meanwhile
+        reconcile_models = self.env['account.reconcile.model'].search([('company_id', '=', line.company_id.id)])
+        self.assertTrue(line._is_online_match_valid(reconcile_models))
+        self.assertFalse(line._is_online_match_valid(reconcile_models, partner_map={line.id: self.partner_b.id}))
+        self.assertFalse(line._is_online_match_valid(reconcile_models, excluded_ids=receivable_line.ids))
+
+    def test_statement_max_lines(self):
+        self.bank_journal.write({'bank_statement_creation_groupby': 'month', 'bank_statement_max_lines': 2})
+        transactions = self.create_transactions(['2016-01-01', '2016-01-02', '2016-01-03', '2016-01-04', '2016-01-05'])
+        self.online_account.balance = 50
+        self.bnk_stmt._online_sync_bank_statement(transactions, self.online_account)
+        statements = self.bnk_stmt.search([('journal_id', '=', self.bank_journal.id)], order='date asc, id asc')
+        self.assertRecordValues(statements, [
+            {'date': fields.Date.from_string('2016-01-01'), 'balance_start': 0.0, 'balance_end_real': 20.0},
+            {'date': fields.Date.from_string('2016-01-01'), 'balance_start': 20.0, 'balance_end_real': 40.0},
+            {'date': fields.Date.from_string('2016-01-01'), 'balance_start': 40.0, 'balance_end_real': 50.0},
+        ])
+        self.assertEqual([len(statement.line_ids) for statement in statements], [2, 2, 1])
+
+        # The next transactions of the period fill the last statement, then roll over into a new one
+        transactions = self.create_transactions(['2016-01-06', '2016-01-07'])
+        self.online_account.balance = 70
+        self.bnk_stmt._online_sync_bank_statement(transactions, self.online_account)
+        statements = self.bnk_stmt.search([('journal_id', '=', self.bank_journal.id)], order='date asc, id asc')
+        self.assertEqual([len(statement.line_ids) for statement in statements], [2, 2, 2, 1])
+        self.assertRecordValues(statements[2:], [
+            {'state': 'posted', 'balance_start': 40.0, 'balance_end_real': 60.0},
+            {'state': 'posted', 'balance_start': 60.0, 'balance_end_real': 70.0},
+        ])
+
+    def test_ingestion_hooks_batch(self):
+        # The hooks are called once per batch, with the transactions that are not imported yet
+        transactions = self.create_transactions(['2016-01-01', '2016-01-02'])
+        self.bnk_stmt._online_sync_bank_statement(transactions, self.online_account)
+        calls = []
+        enrich = type(self.bnk_stmt)._online_sync_enrich_transactions
+
+        def _online_sync_enrich_transactions(statement, lines, journal):
+            calls.append([line['online_transaction_identifier'] for line in lines])
+            for line in lines:
+                line['online_partner_information'] = 'enriched'
+            return enrich(statement, lines, journal)
+
+        transactions = transactions + self.create_transactions(['2016-01-03', '2016-01-04'])
+        with patch.object(type(self.bnk_stmt), '_online_sync_enrich_transactions', _online_sync_enrich_transactions):
+            lines = self.bnk_stmt._online_sync_bank_statement(transactions, self.online_account)
+        self.assertEqual(calls, [[transactions[2]['online_transaction_identifier'], transactions[3]['online_transaction_identifier']]])
+        self.assertEqual(lines.mapped('online_partner_information'), ['enriched', 'enriched'])
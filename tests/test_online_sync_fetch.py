@@ -0,0 +1,657 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import base64
+import json
+import threading
+import uuid
+from contextlib import contextmanager
+
+from dateutil.relativedelta import relativedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.addons.account_online_synchronization.models import account_online, sync_tracing
+from odoo.tests import tagged
+
+
+@tagged('post_install', '-at_install')
+class TestSynchFetch(AccountTestInvoicingCommon):
+    def setUp(self):
+        super(TestSynchFetch, self).setUp()
+        self.link_account = self.env['account.online.link'].create({'name': 'Test Bank', 'state': 'connected'})
+        self.online_accounts = self.env['account.online.account']
+        for code in ('A', 'B'):
+            journal = self.env['account.journal'].create({
+                'name': 'Bank_Online_%s' % code,
+                'type': 'bank',
+                'code': 'BNK%s' % code,
+                'currency_id': self.env.ref('base.EUR').id,
+            })
+            self.online_accounts += self.env['account.online.account'].create({
+                'name': 'MyBankAccount %s' % code,
+                'online_identifier': code,
+                'account_online_link_id': self.link_account.id,
+                'journal_ids': [(6, 0, journal.ids)],
+            })
+        self.calls = []
+
+        # The records of the test are not visible from another cursor, and the attachments would outlive the test
+        @contextmanager
+        def _sync_attachment_cursor(link):
+            yield self.env.cr
+
+        patcher = patch.object(type(self.link_account), '_sync_attachment_cursor', _sync_attachment_cursor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @contextmanager
+    def transactions(self):
+        ''' Turn the commits and rollbacks of the test cursor into savepoints, so that a rollback of the code under
+        test only discards what it did since its last commit, as in a real transaction, and keeps the data of the test. '''
+        cr = self.env.cr
+        Cursor = type(cr)
+        commit, rollback = Cursor.commit, Cursor.rollback
+        savepoint = []
+
+        def begin():
+            savepoint[:] = ['test_online_sync_%s' % uuid.uuid4().hex]
+            cr.execute('SAVEPOINT "%s"' % savepoint[0])
+
+        def fake_commit(cursor):
+            if cursor is not cr:
+                return commit(cursor)
+            self.env['base'].flush()
+            cr.execute('RELEASE SAVEPOINT "%s"' % savepoint[0])
+            begin()
+
+        def fake_rollback(cursor):
+            if cursor is not cr:
+                return rollback(cursor)
+            self.env.clear()
+            cr.execute('ROLLBACK TO SAVEPOINT "%s"' % savepoint[0])
+
+        self.env['base'].flush()
+        begin()
+        with patch.object(Cursor, 'commit', fake_commit), patch.object(Cursor, 'rollback', fake_rollback):
+            yield
+        self.env['base'].flush()
+        cr.execute('RELEASE SAVEPOINT "%s"' % savepoint[0])
+
+    def fetch_odoo_fin(self, responses):
+        ''' Return a replacement of _fetch_odoo_fin serving the given responses by (url, account_id) in order
+        and recording the calls made in self.calls. '''
+        responses = {key: list(values) for key, values in responses.items()}
+
+        def _fetch_odoo_fin(link, url, data=None, ignore_status=False):
+            key = (url, (data or {}).get('account_id'))
+            self.calls.append(key)
+            values = responses.get(key)
+            return values.pop(0) if values else {}
+        return _fetch_odoo_fin
+
+    def test_pipelined_refresh(self):
+        self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.pipelined_refresh', 'True')
+        # The refresh of account A needs to be polled twice while account B is ready at once
+        responses = {
+            ('/proxy/v1/refresh', 'A'): [{'next_data': {'page': 2}}, {}],
+            ('/proxy/v1/refresh', 'B'): [{}],
+        }
+        with patch.object(type(self.link_account), '_fetch_odoo_fin', self.fetch_odoo_fin(responses)):
+            self.link_account.with_context(dont_show_transactions=True)._fetch_transactions()
+        # Both refreshes are started before any transaction is downloaded and the transactions of B
+        # are downloaded while the refresh of A is still running.
+        self.assertEqual(self.calls, [
+            ('/proxy/v1/refresh', 'A'),
+            ('/proxy/v1/refresh', 'B'),
+            ('/proxy/v1/transactions', 'B'),
+            ('/proxy/v1/refresh', 'A'),
+            ('/proxy/v1/transactions', 'A'),
+        ])
+
+    def test_sequential_refresh(self):
+        self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.pipelined_refresh', 'False')
+        responses = {
+            ('/proxy/v1/refresh', 'A'): [{'next_data': {'page': 2}}, {}],
+            ('/proxy/v1/refresh', 'B'): [{}],
+        }
+        with patch.object(type(self.link_account), '_fetch_odoo_fin', self.fetch_odoo_fin(responses)):
+            self.link_account.with_context(dont_show_transactions=True)._fetch_transactions()
+        self.assertEqual(self.calls, [
+            ('/proxy/v1/refresh', 'A'),
+            ('/proxy/v1/refresh', 'A'),
+            ('/proxy/v1/transactions', 'A'),
+            ('/proxy/v1/refresh', 'B'),
+            ('/proxy/v1/transactions', 'B'),
+        ])
+
+    def test_pipelined_refresh_needs_user_action(self):
+        self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.pipelined_refresh', 'True')
+        responses = {
+            ('/proxy/v1/refresh', 'A'): [{'next_data': {'page': 2}}, {'code': 300, 'data': {'mode': 'reconnect'}}],
+            ('/proxy/v1/refresh', 'B'): [{}],
+        }
+        with patch.object(type(self.link_account), '_fetch_odoo_fin', self.fetch_odoo_fin(responses)), \
+                patch.object(type(self.link_account), '_open_iframe', lambda link, mode: mode):
+            action = self.link_account._fetch_transactions()
+        self.assertEqual(action, 'reconnect')
+        self.assertNotIn(('/proxy/v1/transactions', 'A'), self.calls)
+
+    def test_fetched_transactions_batch(self):
+        transaction = {'date': '2021-01-04', 'payment_ref': 'Transaction', 'amount': 10.0}
+        responses = {
+            ('/proxy/v1/transactions', 'A'): [{'transactions': [dict(transaction, online_transaction_identifier='A1')]}],
+            ('/proxy/v1/transactions', 'B'): [{'transactions': [dict(transaction, online_transaction_identifier='B1')]}],
+        }
+        with patch.object(type(self.link_account), '_fetch_odoo_fin', self.fetch_odoo_fin(responses)):
+            action = self.link_account._fetch_transactions(refresh=False)
+        run = self.env['account.online.sync.run'].search([('account_online_link_id', '=', self.link_account.id)])
+        self.assertTrue(run.batch)
+        # Only the handle of the batch is sent to the reconciliation widget
+        self.assertEqual(action['context'].get('online_sync_batch'), run.batch)
+        self.assertNotIn('statement_line_ids', action['context'])
+        lines = self.env['account.bank.statement.line'].search([('online_sync_batch', '=', run.batch)])
+        self.assertEqual(sorted(lines.filtered('online_transaction_identifier').mapped('online_transaction_identifier')), ['A1', 'B1'])
+
+        # The reconciliation widget gets the lines of the batch page by page
+        self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.reconciliation_page_size', 1)
+        widget = self.env['account.reconciliation.widget'].with_context(online_sync_batch=run.batch)
+        lines = lines.filtered(lambda l: not l.is_reconciled).sorted('id')
+        data = widget.get_bank_statement_data([])
+        self.assertEqual(data['online_sync_total'], len(lines))
+        self.assertEqual([line['st_line']['id'] for line in data['lines']], lines[:1].ids)
+        page = widget.get_online_sync_batch_page(data['online_sync_last_id'])
+        self.assertEqual([line['st_line']['id'] for line in page['lines']], lines[1:2].ids)
+
+    def test_balance_history(self):
+        transaction = {'date': '2021-01-04', 'payment_ref': 'Transaction', 'amount': 10.0}
+        responses = {
+            ('/proxy/v1/transactions', 'A'): [
+                {'transactions': [dict(transaction, online_transaction_identifier='A1')], 'balance': 25.0, 'next_data': {'page': 2}},
+                {'transactions': [dict(transaction, online_transaction_identifier='A2')], 'balance': 25.0},
+                {'transactions': [], 'balance': 30.0},
+            ],
+        }
+        account_a = self.online_accounts[0]
+        with patch.object(type(self.link_account), '_fetch_odoo_fin', self.fetch_odoo_fin(responses)):
+            self.link_account.with_context(dont_show_transactions=True)._fetch_transactions(refresh=False, accounts=account_a)
+            # A single snapshot per synchronization, whatever the number of pages, the opening statement filling the gap
+            snapshot = self.env['account.online.balance'].search([('account_online_account_id', '=', account_a.id)])
+            self.assertRecordValues(snapshot, [{'balance': 25.0, 'ledger_balance': 25.0, 'drift': 0.0}])
+            self.link_account.with_context(dont_show_transactions=True)._fetch_transactions(refresh=False, accounts=account_a)
+        # The last synchronization of the day replaces the snapshot
+        snapshot = self.env['account.online.balance'].search([('account_online_account_id', '=', account_a.id)])
+        self.assertRecordValues(snapshot, [{'date': fields.Date.context_today(snapshot), 'balance': 30.0, 'ledger_balance': 25.0, 'drift': 5.0}])
+        self.assertEqual(self.env['account.online.balance']._get_balances_at(self.online_accounts, fields.Date.today()), snapshot)
+        self.assertFalse(self.env['account.online.balance']._get_balances_at(self.online_accounts, '2020-01-01'))
+
+    def test_cron_digest(self):
+        def _fetch_odoo_fin(link, url, data=None, ignore_status=False):
+            if url == '/proxy/v1/refresh':
+                link._log_information(state='connected', subject='Message', message='Refreshed')
+                return {}
+            link._log_information(state='error', subject='Error', message='Bank unavailable', reset_tx=True)
+
+        messages = self.link_account.message_ids
+        with patch.object(type(self.link_account), '_fetch_odoo_fin', _fetch_odoo_fin), \
+                self.transactions():
+            self.env['account.journal']._cron_fetch_online_transactions()
+        self.assertEqual(self.link_account.state, 'error')
+        # A single message for the whole run, without tracking
+        new_messages = self.link_account.message_ids - messages
+        self.assertEqual(len(new_messages), 1)
+        self.assertEqual(new_messages.subject, 'Synchronization summary')
+        self.assertIn('Refreshed', new_messages.body)
+        self.assertIn('Bank unavailable', new_messages.body)
+        self.assertFalse(new_messages.tracking_value_ids)
+
+    def test_cron_groups_accounts_by_link(self):
+        self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.pipelined_refresh', 'False')
+        sessions = []
+
+        def _fetch_odoo_fin(link, url, data=None, ignore_status=False):
+            self.calls.append((url, (data or {}).get('account_id')))
+            sessions.append(account_online.odoo_fin_transport.session)
+            return {}
+
+        with patch.object(type(self.link_account), '_fetch_odoo_fin', _fetch_odoo_fin), \
+                self.transactions():
+            self.env['account.journal']._cron_fetch_online_transactions()
+        self.assertEqual(self.calls, [
+            ('/proxy/v1/refresh', 'A'), ('/proxy/v1/transactions', 'A'),
+            ('/proxy/v1/refresh', 'B'), ('/proxy/v1/transactions', 'B'),
+        ])
+        # A single synchronization of the link, all its calls going through the same session
+        self.assertEqual(self.env['account.online.sync.run'].search_count([('account_online_link_id', '=', self.link_account.id)]), 1)
+        self.assertTrue(sessions[0])
+        self.assertEqual(set(sessions), {sessions[0]})
+        self.assertIsNone(getattr(account_online.odoo_fin_transport, 'session', None))
+
+    def test_cron_backoff(self):
+        def _fetch_odoo_fin(link, url, data=None, ignore_status=False):
+            self.calls.append(url)
+            link.provider_data = 'lost'
+            link._log_information(state='error', subject='Error', message='Bank unavailable', reset_tx=True)
+
+        with patch.object(type(self.link_account), '_fetch_odoo_fin', _fetch_odoo_fin), \
+                self.transactions():
+            self.env['account.journal']._cron_fetch_online_transactions()
+            # The work of the failed synchronization is rolled back, its failure is kept
+            self.assertNotEqual(self.link_account.provider_data, 'lost')
+            self.assertEqual(self.link_account.state, 'error')
+            self.assertEqual(self.link_account.sync_failure_count, 1)
+            self.assertTrue(self.link_account.sync_retry_after > fields.Datetime.now())
+            self.assertEqual(self.env['account.online.sync.run'].search([('account_online_link_id', '=', self.link_account.id)]).mapped('state'), ['failed'])
+            # The link is skipped until its retry date, then backs off twice as long
+            calls = len(self.calls)
+            self.env['account.journal']._cron_fetch_online_transactions()
+            self.assertEqual(len(self.calls), calls)
+            # Later on, once the retry date is reached
+            self.link_account.sync_retry_after = '2020-01-01 00:00:00'
+            self.env['account.online.sync.run'].search([('account_online_link_id', '=', self.link_account.id)]).date_start = '2020-01-01 00:00:00'
+            retry_start = fields.Datetime.now()
+            self.env['account.journal']._cron_fetch_online_transactions()
+        self.assertEqual(self.link_account.sync_failure_count, 2)
+        self.assertTrue(self.link_account.sync_retry_after >= retry_start + relativedelta(hours=2))
+
+        # A link needing the user is quarantined until it is reconnected
+        self.link_account.state = 'disconnected'
+        self.link_account._update_sync_backoff(needs_action=True)
+        self.assertTrue(self.link_account.sync_quarantined)
+        self.assertFalse(self.link_account._is_cron_sync_allowed())
+        self.link_account.success('reconnect', {})
+        self.assertFalse(self.link_account.sync_quarantined)
+        self.assertFalse(self.link_account.sync_failure_count)
+        self.assertTrue(self.link_account._is_cron_sync_allowed())
+
+    def test_manual_sync_lifts_quarantine(self):
+        self.link_account.write({'sync_quarantined': True, 'sync_failure_count': 3, 'sync_retry_after': '2999-01-01 00:00:00'})
+        self.assertFalse(self.link_account._is_cron_sync_allowed())
+        journal = self.online_accounts[0].journal_ids
+        with patch.object(type(self.link_account), '_fetch_odoo_fin', self.fetch_odoo_fin({})), \
+                self.transactions():
+            journal.manual_sync()
+        # A successful synchronization by the user gives the link back to the cron
+        self.assertFalse(self.link_account.sync_quarantined)
+        self.assertFalse(self.link_account.sync_failure_count)
+        self.assertFalse(self.link_account.sync_retry_after)
+        self.assertTrue(self.link_account._is_cron_sync_allowed())
+
+    def test_concurrent_synchronization(self):
+        with self.env.registry.cursor() as lock_cr, \
+                patch.object(type(self.link_account), '_fetch_odoo_fin', self.fetch_odoo_fin({})):
+            # Another worker is synchronizing the link
+            lock_cr.execute('SELECT pg_advisory_xact_lock(%s, %s)', [account_online.SYNC_LOCK_NAMESPACE, self.link_account.id])
+            action = self.link_account._fetch_transactions()
+            self.assertFalse(self.calls)
+            self.assertEqual(action, self.link_account._show_sync_in_progress_action())
+            lock_cr.rollback()
+            # Once it is done, the link can be synchronized again
+            self.link_account.with_context(dont_show_transactions=True)._fetch_transactions()
+            self.assertTrue(self.calls)
+
+    def test_cron_skips_busy_link(self):
+        self.link_account.write({'sync_failure_count': 2, 'sync_retry_after': '2020-01-01 00:00:00'})
+        with self.env.registry.cursor() as lock_cr, \
+                patch.object(type(self.link_account), '_fetch_odoo_fin', self.fetch_odoo_fin({})), \
+                self.transactions():
+            # Someone else is synchronizing the link
+            lock_cr.execute('SELECT pg_advisory_xact_lock(%s, %s)', [account_online.SYNC_LOCK_NAMESPACE, self.link_account.id])
+            self.env['account.journal']._cron_fetch_online_transactions()
+        # The synchronization did not run, its backoff is left untouched
+        self.assertFalse(self.calls)
+        self.assertEqual(self.link_account.sync_failure_count, 2)
+
+    def test_enqueue_after_running_job(self):
+        SyncJob = self.env['account.online.sync.job']
+        running_job = SyncJob.create({'account_online_link_id': self.link_account.id, 'state': 'running'})
+        with patch.object(type(self.env['ir.cron']), '_trigger', lambda cron, at=None: None):
+            job = SyncJob._enqueue(self.link_account)
+            # The running job may miss the transactions the request is about
+            self.assertNotEqual(job, running_job)
+            self.assertEqual(job.state, 'pending')
+            # The requests of other users are merged in the pending job
+            other_user = self.env['res.users'].create({'name': 'Other', 'login': 'other_online_sync_user'})
+            self.assertEqual(SyncJob.with_user(other_user)._enqueue(self.link_account), job)
+        self.assertEqual(job.notified_user_ids, other_user)
+
+    def test_enqueue_coalescing_delay(self):
+        SyncJob = self.env['account.online.sync.job']
+        processed = []
+
+        def _process(job):
+            processed.append(job)
+            job.state = 'done'
+
+        with patch.object(type(self.env['ir.cron']), '_trigger', lambda cron, at=None: None), \
+                patch.object(type(SyncJob), '_process', _process):
+            job = SyncJob._enqueue(self.link_account, delay=60)
+            self.assertTrue(job.date_planned > fields.Datetime.now())
+            # The job waits for the other requests of the burst
+            SyncJob._cron_process_sync_jobs()
+            self.assertFalse(processed)
+            # Every request of the burst postpones it
+            job.date_planned = fields.Datetime.now() + relativedelta(seconds=10)
+            SyncJob._enqueue(self.link_account, delay=60)
+            self.assertTrue(job.date_planned >= fields.Datetime.now() + relativedelta(seconds=59))
+            job.date_planned = fields.Datetime.now() + relativedelta(hours=1)
+            SyncJob._enqueue(self.link_account, delay=60)
+            self.assertTrue(job.date_planned > fields.Datetime.now() + relativedelta(minutes=59))
+            # A request of a user does not wait
+            self.assertEqual(SyncJob._enqueue(self.link_account), job)
+            SyncJob._cron_process_sync_jobs()
+        self.assertEqual(processed, [job])
+
+    def test_cron_unexpected_error(self):
+        other_link = self.env['account.online.link'].create({'name': 'Other Bank', 'state': 'connected', 'last_refresh': '2020-01-01 00:00:00'})
+        journal = self.env['account.journal'].create({'name': 'Bank_Online_C', 'type': 'bank', 'code': 'BNKC'})
+        self.env['account.online.account'].create({
+            'name': 'MyBankAccount C',
+            'online_identifier': 'C',
+            'account_online_link_id': other_link.id,
+            'journal_ids': [(6, 0, journal.ids)],
+        })
+
+        def _fetch_odoo_fin(link, url, data=None, ignore_status=False):
+            self.calls.append((url, (data or {}).get('account_id')))
+            if link == other_link:
+                link.provider_data = 'lost'
+                raise KeyError('unexpected')
+            return {}
+
+        with patch.object(type(self.link_account), '_fetch_odoo_fin', _fetch_odoo_fin), \
+                self.transactions():
+            self.env['account.journal']._cron_fetch_online_transactions()
+        # The work of the failing link is rolled back, it is backed off and logged, the other one is synchronized anyway
+        self.assertFalse(other_link.provider_data)
+        self.assertEqual(other_link.last_refresh, fields.Datetime.to_datetime('2020-01-01 00:00:00'))
+        self.assertEqual(other_link.sync_failure_count, 1)
+        self.assertEqual(other_link.state, 'error')
+        self.assertEqual(self.env['account.online.sync.run'].search([('account_online_link_id', '=', other_link.id)]).mapped('state'), ['failed'])
+        self.assertIn(('/proxy/v1/refresh', 'A'), self.calls)
+        self.assertFalse(self.link_account.sync_failure_count)
+
+    def test_cron_time_budget(self):
+        stale_link = self.env['account.online.link'].create({'name': 'Stale Bank', 'state': 'connected', 'last_refresh': '2020-01-01 00:00:00'})
+        journal = self.env['account.journal'].create({'name': 'Bank_Online_C', 'type': 'bank', 'code': 'BNKC'})
+        self.env['account.online.account'].create({
+            'name': 'MyBankAccount C',
+            'online_identifier': 'C',
+            'account_online_link_id': stale_link.id,
+            'journal_ids': [(6, 0, journal.ids)],
+        })
+        self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.cron_time_budget', '0.000001')
+        triggers = []
+        with patch.object(type(self.link_account), '_fetch_odoo_fin', self.fetch_odoo_fin({})), \
+                patch.object(type(self.env['ir.cron']), '_trigger', lambda cron, at=None: triggers.append(cron.id)), \
+                self.transactions():
+            self.env['account.journal']._cron_fetch_online_transactions()
+            # Only the link synchronized the longest ago fits in the budget, the cron is triggered again for the others
+            self.assertEqual(self.calls[0], ('/proxy/v1/refresh', 'C'))
+            self.assertNotIn(('/proxy/v1/refresh', 'A'), self.calls)
+            self.assertEqual(triggers, [self.env.ref('account_online_synchronization.online_sync_cron').id])
+
+            # The triggered run goes on with the link left, without starting over with the one just synchronized
+            self.calls.clear()
+            self.env['account.journal']._cron_fetch_online_transactions()
+            self.assertEqual(self.calls[0], ('/proxy/v1/refresh', 'A'))
+            self.assertNotIn(('/proxy/v1/refresh', 'C'), self.calls)
+            # Every link has been attempted, the cycle is over
+            self.assertEqual(len(triggers), 1)
+            self.assertFalse(self.env['ir.config_parameter'].sudo().get_param('account_online_synchronization.cron_cycle_start'))
+
+    def test_fetch_accounts_diff(self):
+        account_a, account_b = self.online_accounts
+        remote_accounts = {'accounts': [
+            {'online_identifier': 'A', 'name': 'MyBankAccount A renamed', 'balance': 100.0},
+            {'online_identifier': 'C', 'name': 'MyBankAccount C', 'balance': 10.0},
+        ]}
+        responses = {('/proxy/v1/accounts', None): [remote_accounts, remote_accounts]}
+        AccountOnlineAccount = type(account_a)
+        with patch.object(type(self.link_account), '_fetch_odoo_fin', self.fetch_odoo_fin(responses)):
+            new_accounts = self.link_account._fetch_accounts()
+            self.assertEqual(new_accounts.mapped('online_identifier'), ['C'])
+            self.assertFalse(account_b.exists())
+            self.assertRecordValues(account_a, [{'name': 'MyBankAccount A renamed', 'balance': 100.0}])
+
+            # Nothing changed, nothing is written
+            with patch.object(AccountOnlineAccount, 'write', autospec=True, side_effect=AccountOnlineAccount.write) as write:
+                self.assertFalse(self.link_account._fetch_accounts())
+            write.assert_not_called()
+        self.assertEqual(sorted(self.link_account.account_online_account_ids.mapped('online_identifier')), ['A', 'C'])
+
+    def test_prefetch_pages(self):
+        self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.prefetch_pages', 'True')
+        self.link_account.provider_data = 'old'
+        account = self.online_accounts[0]
+        requests = []
+
+        sessions = set()
+
+        def send_odoo_fin_request(request):
+            page = (request['data'].get('next_data') or {}).get('page', 1)
+            requests.append((page, request['data']['provider_data']))
+            sessions.add(request['session'])
+            result = {'transactions': [{'online_transaction_identifier': 'A%s' % page, 'date': '2021-01-04', 'payment_ref': 'Page %s' % page, 'amount': 10.0}]}
+            if page < 3:
+                result['next_data'] = {'page': page + 1}
+            if page == 1 and request['data']['provider_data'] == 'old':
+                # The credentials are renewed by the first page
+                result['provider_data'] = 'new'
+            return {'json': {'result': result}, 'duration': 0.0, 'status': 200, 'size': 0}
+
+        with patch('odoo.addons.account_online_synchronization.models.account_online.send_odoo_fin_request', send_odoo_fin_request), \
+                self.transactions():
+            with self.link_account._odoo_fin_session() as link_session:
+                transactions = account._download_transactions_prefetched({'account_id': account.online_identifier})
+        self.assertEqual([t['online_transaction_identifier'] for t in transactions], ['A1', 'A2', 'A3'])
+        # The worker does not share the connection of the synchronization
+        self.assertEqual(len(sessions), 1)
+        self.assertNotIn(link_session, sessions)
+        # The second page was requested before the first one was handled, with the provider_data renewed by the first one
+        self.assertEqual(requests, [(1, 'old'), (2, 'new'), (3, 'new')])
+        self.assertEqual(self.link_account.provider_data, 'new')
+
+    def test_download_without_prefetch(self):
+        account = self.online_accounts[0]
+        requests = []
+
+        def send_odoo_fin_request(request):
+            page = (request['data'].get('next_data') or {}).get('page', 1)
+            requests.append(page)
+            result = {'transactions': [{'online_transaction_identifier': 'A%s' % page, 'date': '2021-01-04', 'payment_ref': 'Page %s' % page, 'amount': 10.0}]}
+            if page < 2:
+                result['next_data'] = {'page': page + 1}
+            return {'json': {'result': result}, 'duration': 0.0, 'status': 200, 'size': 0}
+
+        transport = 'odoo.addons.account_online_synchronization.models.account_online.send_odoo_fin_request'
+        with patch(transport, send_odoo_fin_request), self.transactions(), \
+                patch.object(type(account), '_download_transactions_prefetched', side_effect=AssertionError('No prefetch when disabled')):
+            stmt_lines = account._retrieve_transactions()
+        self.assertEqual(sorted(stmt_lines.filtered('online_transaction_identifier').mapped('online_transaction_identifier')), ['A1', 'A2'])
+        # Every page is requested once the previous one is handled
+        self.assertEqual(requests, [1, 2])
+
+        # Without a next page, nothing is prefetched
+        self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.prefetch_pages', 'True')
+        requests.clear()
+        with patch(transport, send_odoo_fin_request), self.transactions():
+            transactions = account._download_transactions_prefetched({'account_id': account.online_identifier, 'next_data': {'page': 2}})
+        self.assertEqual([t['online_transaction_identifier'] for t in transactions], ['A2'])
+        self.assertEqual(requests, [2])
+
+    def test_background_job(self):
+        statuses = []
+        SyncJob = type(self.env['account.online.sync.job'])
+
+        @contextmanager
+        def background_worker():
+            with patch.object(SyncJob, '_notify_user', lambda job, status, **payload: statuses.append((job.state, status))), \
+                    patch.object(type(self.env['ir.cron']), '_trigger', lambda cron, at=None: None), \
+                    self.transactions():
+                yield
+
+        with background_worker():
+            # pending -> running -> done
+            self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.background_sync', 'True')
+            with patch.object(type(self.link_account), '_fetch_odoo_fin', self.fetch_odoo_fin({})):
+                action = self.online_accounts[0].journal_ids.manual_sync()
+                self.assertEqual(action['tag'], 'display_notification')
+                job = self.env['account.online.sync.job'].search([('account_online_link_id', '=', self.link_account.id)])
+                self.assertRecordValues(job, [{'state': 'pending', 'account_online_account_ids': self.online_accounts[0].ids}])
+                self.env['account.online.sync.job']._cron_process_sync_jobs()
+            self.assertEqual(job.state, 'done')
+            self.assertEqual(statuses, [('running', 'started'), ('running', 'progress'), ('done', 'done')])
+
+            # pending -> running -> failed
+            def _fetch_odoo_fin(link, url, data=None, ignore_status=False):
+                link._log_information(state='error', subject='Error', message='Bank unavailable', reset_tx=True)
+
+            statuses.clear()
+            job = SyncJob._enqueue(self.link_account)
+            with patch.object(type(self.link_account), '_fetch_odoo_fin', _fetch_odoo_fin):
+                self.env['account.online.sync.job']._cron_process_sync_jobs()
+            self.assertRecordValues(job, [{'state': 'failed', 'message': 'Bank unavailable'}])
+            self.assertEqual(statuses, [('running', 'started'), ('failed', 'failed')])
+
+        # The link is being synchronized by someone else
+        statuses.clear()
+        with self.env.registry.cursor() as lock_cr, background_worker():
+            lock_cr.execute('SELECT pg_advisory_xact_lock(%s, %s)', [account_online.SYNC_LOCK_NAMESPACE, self.link_account.id])
+            job = SyncJob._enqueue(self.link_account)
+            self.env['account.online.sync.job']._cron_process_sync_jobs()
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(statuses, [('running', 'started'), ('done', 'busy')])
+
+    def test_background_job_cron(self):
+        SyncJob = self.env['account.online.sync.job']
+        other_link = self.env['account.online.link'].create({'name': 'Other Bank', 'state': 'connected'})
+        statuses, triggers = [], []
+        with patch.object(type(SyncJob), '_notify_user', lambda job, status, **payload: statuses.append((job.id, status))), \
+                patch.object(type(self.env['ir.cron']), '_trigger', lambda cron, at=None: triggers.append(cron.id)), \
+                patch.object(type(self.link_account), '_fetch_odoo_fin', self.fetch_odoo_fin({})), \
+                self.transactions():
+            # The worker running this job has been killed
+            lost_job = SyncJob.create({'account_online_link_id': other_link.id, 'state': 'running', 'date_start': '2020-01-01 00:00:00'})
+            jobs = SyncJob._enqueue(self.link_account) | SyncJob._enqueue(other_link)
+            self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.cron_time_budget', '0.000001')
+            triggers.clear()
+            SyncJob._cron_process_sync_jobs()
+        self.assertRecordValues(lost_job, [{'state': 'failed'}])
+        self.assertEqual(statuses[0], (lost_job.id, 'failed'))
+        # Only the first job fits in the budget, the cron is triggered again for the other one
+        self.assertEqual(jobs.mapped('state'), ['done', 'pending'])
+        self.assertEqual(triggers, [self.env.ref('account_online_synchronization.online_sync_job_cron').id])
+
+    def test_profile_sync(self):
+        self.link_account.sudo().profile_next_sync = True
+        with patch.object(type(self.link_account), '_fetch_odoo_fin', self.fetch_odoo_fin({})):
+            self.link_account.with_context(dont_show_transactions=True)._fetch_transactions()
+        # Only the next synchronization is profiled
+        self.assertFalse(self.link_account.sudo().profile_next_sync)
+        attachments = self.env['ir.attachment'].search([
+            ('res_model', '=', 'account.online.link'), ('res_id', '=', self.link_account.id), ('name', '=like', 'sync_profile_%'),
+        ])
+        self.assertEqual(sorted(attachments.mapped('mimetype')), ['application/octet-stream', 'text/plain'])
+        report = base64.b64decode(attachments.filtered(lambda a: a.mimetype == 'text/plain').datas).decode('utf-8')
+        self.assertIn('refresh', report)
+        self.assertIn('Proxy calls: 0', report)
+        self.assertIn('_fetch_transactions_run', report)
+
+    def test_tracer_restores_thread(self):
+        seen = []
+
+        def run():
+            thread = threading.current_thread()
+            with sync_tracing.tracing(sync_tracing.SyncTracer()):
+                seen.append(hasattr(thread, 'query_count'))
+            seen.append(hasattr(thread, 'query_count'))
+
+        # The queries of the thread are only counted during the synchronization
+        worker = threading.Thread(target=run)
+        worker.start()
+        worker.join()
+        self.assertEqual(seen, [True, False])
+
+    def test_sync_runs(self):
+        with patch.object(type(self.link_account), '_fetch_odoo_fin', self.fetch_odoo_fin({})):
+            self.link_account.with_context(dont_show_transactions=True)._fetch_transactions()
+        SyncRun = self.env['account.online.sync.run']
+        run = SyncRun.search([('account_online_link_id', '=', self.link_account.id)])
+        self.assertRecordValues(run, [{'state': 'done', 'cron': False, 'message': False}])
+        self.assertTrue(run.batch)
+        self.assertGreaterEqual(run.duration, run.refresh_duration)
+
+        # The runs are kept for the configured number of days
+        self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.sync_run_retention_days', 30)
+        old_run = run.copy({'date_start': fields.Datetime.now() - relativedelta(days=31)})
+        SyncRun._gc_sync_runs()
+        self.assertFalse(old_run.exists())
+        self.assertTrue(run.exists())
+
+    def test_adaptive_timeout(self):
+        self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.request_timeout', 60)
+        self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.request_timeout_max', 80)
+        other_link = self.env['account.online.link'].create({'name': 'Other Bank', 'state': 'connected'})
+        with patch.dict(account_online.request_latencies, clear=True):
+            # Not enough calls to know better than the configured timeout
+            self.assertEqual(self.link_account._get_request_timeout('/proxy/v1/get_access_token'), 60)
+            for dummy in range(30):
+                self.link_account._record_request_latency('/proxy/v1/get_access_token', 0.2)
+                self.link_account._record_request_latency('/proxy/v1/transactions', 8.0)
+                other_link._record_request_latency('/proxy/v1/transactions', 30.0)
+            # Light calls get the floor, heavy ones three times their usual duration, within the configured maximum
+            self.assertEqual(self.link_account._get_request_timeout('/proxy/v1/get_access_token'), 5)
+            self.assertEqual(self.link_account._get_request_timeout('/proxy/v1/transactions'), 24)
+            self.assertEqual(other_link._get_request_timeout('/proxy/v1/transactions'), 80)
+
+    def test_record_and_replay(self):
+        self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.pipelined_refresh', 'False')
+        self.link_account.provider_data = 'secret'
+        account = self.online_accounts[0]
+        expired = []
+
+        def send_odoo_fin_request(request):
+            url = request['url']
+            if url == '/proxy/v1/transactions' and not expired:
+                expired.append(url)
+                error = {'code': 101, 'message': 'Access token expired', 'data': {'message': 'Access token expired'}}
+                return {'json': {'error': error}, 'duration': 0.1, 'status': 200, 'size': 0}
+            if url == '/proxy/v1/get_access_token':
+                result = {'access_token': 'token'}
+            elif url == '/proxy/v1/transactions':
+                transaction = {'online_transaction_identifier': 'A1', 'date': '2021-01-04', 'payment_ref': 'Transaction', 'amount': 10.0}
+                result = {'transactions': [transaction], 'balance': 10.0, 'provider_data': 'renewed'}
+            else:
+                result = {}
+            return {'json': {'result': result}, 'duration': 0.1, 'status': 200, 'size': 0}
+
+        transport = 'odoo.addons.account_online_synchronization.models.account_online.send_odoo_fin_request'
+        with patch(transport, send_odoo_fin_request), self.transactions():
+            self.link_account.with_context(online_sync_record=True, dont_show_transactions=True)._fetch_transactions(accounts=account)
+        attachment = self.env['ir.attachment'].search([
+            ('res_model', '=', 'account.online.link'), ('res_id', '=', self.link_account.id), ('name', '=like', 'sync_recording_%'),
+        ])
+        recording = json.loads(base64.b64decode(attachment.datas))
+        self.assertEqual([call['url'] for call in recording['calls']], [
+            '/proxy/v1/refresh', '/proxy/v1/transactions', '/proxy/v1/get_access_token', '/proxy/v1/transactions',
+        ])
+        # The credentials are not recorded
+        self.assertFalse(recording['calls'][0]['request']['provider_data'])
+        self.assertFalse(recording['calls'][2]['response']['result']['access_token'])
+        self.assertFalse(recording['calls'][3]['response']['result']['provider_data'])
+
+        # The replay goes through the whole synchronization without reaching the proxy nor committing
+        with patch(transport, side_effect=AssertionError('The proxy must not be reached')), \
+                patch.object(type(self.env.cr), 'commit', side_effect=AssertionError('The replay must not commit')), \
+                patch.dict(account_online.request_latencies, clear=True):
+            res, remaining = self.link_account._replay_sync_recording(attachment)
+            # The recorded durations do not change the timeouts of the proxy calls
+            self.assertFalse(account_online.request_latencies)
+        self.assertEqual(remaining, 0)
+        run = self.env['account.online.sync.run'].search([('account_online_link_id', '=', self.link_account.id)], limit=1)
+        self.assertRecordValues(run, [{'state': 'done', 'request_count': 4, 'transactions_received': 1}])
+        self.assertEqual(self.link_account.provider_data, 'renewed')
+        # The renewal of the access token is replayed without erasing the token of the link
+        self.assertEqual(self.link_account.access_token, 'token')
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import logging
+import time
+from unittest.mock import patch
+
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.addons.account_online_synchronization.models import sync_tracing
+from odoo.tests import tagged
+
+from .odoofin_proxy import StandInOdooFinProxy
+
+_logger = logging.getLogger(__name__)
+
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))]
+
+
+@tagged('post_install', '-at_install', '-standard', 'online_sync_load')
+class TestSynchLoad(AccountTestInvoicingCommon):
+    """ Load test of the scheduled synchronization against a local stand-in of the Odoo Fin proxy.
+        It is not part of the standard tests, run it with --test-tags online_sync_load and tune
+        the class attributes to simulate the database to benchmark.
+    """
+    links = 5
+    accounts_per_link = 3
+    proxy_options = {
+        'transactions': 200,
+        'page_size': 50,
+        'refresh_polls': 2,
+        'latency': 0.01,
+        'jitter': 20,
+    }
+
+    def setUp(self):
+        super(TestSynchLoad, self).setUp()
+        self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.background_sync', False)
+        self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.deferred_posting', False)
+        self.env['ir.config_parameter'].sudo().set_param('account_online_synchronization.cron_time_budget', 0)
+        self.online_links = self.env['account.online.link']
+        for link_index in range(self.links):
+            link = self.env['account.online.link'].create({
+                'name': 'Load Test Bank %s' % link_index,
+                'state': 'connected',
+                'auto_sync': True,
+            })
+            for account_index in range(self.accounts_per_link):
+                journal = self.env['account.journal'].create({
+                    'name': 'Bank_Load_%s_%s' % (link_index, account_index),
+                    'type': 'bank',
+                    'code': 'L%sA%s' % (link_index, account_index),
+                    'currency_id': self.env.ref('base.EUR').id,
+                })
+                self.env['account.online.account'].create({
+                    'name': 'Load Account %s' % account_index,
+                    'online_identifier': 'L%s-ACC-%s' % (link_index, account_index),
+                    'account_online_link_id': link.id,
+                    'journal_ids': [(6, 0, journal.ids)],
+                })
+            self.online_links += link
+
+    def run_cron(self, **proxy_options):
+        ''' Run the synchronization cron against a stand-in proxy and log its statistics.
+        :return: The stand-in proxy and the tracer that observed the run.
+        '''
+        options = dict(self.proxy_options, accounts=self.accounts_per_link, **proxy_options)
+        with StandInOdooFinProxy(**options) as proxy:
+            Link = type(self.env['account.online.link'])
+            # The cron commits after every journal and rolls back on errors, keep everything in the test transaction
+            with patch.object(Link, '_get_proxy_url', lambda link, proxy_mode, url: proxy.url + url), \
+                    patch.object(type(self.env.cr), 'commit', lambda cr: None), \
+                    patch.object(type(self.env.cr), 'rollback', lambda cr: None):
+                query_count = self.env.cr.sql_log_count
+                start = time.time()
+                with sync_tracing.tracing(sync_tracing.SyncTracer()) as tracer:
+                    self.env['account.journal']._cron_fetch_online_transactions()
+                duration = time.time() - start
+                query_count = self.env.cr.sql_log_count - query_count
+
+        runs = self.env['account.online.sync.run'].search([('account_online_link_id', 'in', self.online_links.ids)])
+        latencies = [request['duration'] for request in tracer.requests]
+        run_durations = runs.mapped('duration')
+        inserted = tracer.counters.get('transactions_inserted', 0)
+        _logger.info(
+            'Online sync load test: %d links x %d accounts in %.2fs, %d transactions inserted (%.1f/s), %d queries\n'
+            '  proxy calls: %d, latency p50 %.3fs, p95 %.3fs, p99 %.3fs\n'
+            '  sync runs: %d, duration p50 %.3fs, p95 %.3fs, p99 %.3fs\n'
+            '  phases: %s',
+            self.links, self.accounts_per_link, duration, inserted, inserted / duration if duration else 0.0, query_count,
+            len(latencies), percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99),
+            len(runs), percentile(run_durations, 50), percentile(run_durations, 95), percentile(run_durations, 99),
+            ', '.join('%s %.2fs/%d queries' % (name, stats['duration'], stats['queries']) for name, stats in tracer.phases.items()),
+        )
+        return proxy, tracer
+
+    def test_load_cron(self):
+        proxy, tracer = self.run_cron()
+        expected = self.links * self.accounts_per_link * self.proxy_options['transactions']
+        self.assertEqual(tracer.counters.get('transactions_inserted', 0), expected)
+        self.assertEqual(
+            self.env['account.bank.statement.line'].search_count([('journal_id.account_online_link_id', 'in', self.online_links.ids)]),
+            expected)
+
+    def test_load_cron_with_errors(self):
+        # Expired tokens are renewed transparently, every transaction must still be imported
+        proxy, tracer = self.run_cron(errors={101: 0.05, 102: 0.02})
+        self.assertTrue(any(call['error'] in (101, 102) for call in proxy.calls))
+        expected = self.links * self.accounts_per_link * self.proxy_options['transactions']
+        self.assertEqual(tracer.counters.get('transactions_inserted', 0), expected)
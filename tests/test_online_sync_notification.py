@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import base64
+
+import requests
+
+import odoo.tests
+from odoo.addons.account_online_synchronization.models.odoofin_auth import OdooFinAuth
+
+
+@odoo.tests.tagged('post_install', '-at_install')
+class TestSynchNotification(odoo.tests.HttpCase):
+    def setUp(self):
+        super(TestSynchNotification, self).setUp()
+        self.link_account = self.env['account.online.link'].create({
+            'name': 'Test Bank',
+            'state': 'connected',
+            'client_id': 'test_client',
+            'access_token': 'test_access_token',
+            'refresh_token': base64.b64encode(b'test_refresh_token').decode(),
+        })
+        self.online_accounts = self.env['account.online.account']
+        for code in ('A', 'B'):
+            journal = self.env['account.journal'].create({'name': 'Bank_Online_%s' % code, 'type': 'bank', 'code': 'BNK%s' % code})
+            self.online_accounts += self.env['account.online.account'].create({
+                'name': 'MyBankAccount %s' % code,
+                'online_identifier': code,
+                'account_online_link_id': self.link_account.id,
+                'journal_ids': [(6, 0, journal.ids)],
+            })
+        self.authenticate(None, None)
+
+    def notify(self, body, sender=None):
+        ''' Stand-in of the proxy, sending a notification signed like the requests sent to the proxy. '''
+        url = 'http://%s:%s/account_online_synchronization/notification' % (odoo.tests.HOST, odoo.tools.config['http_port'])
+        return self.opener.post(url, json=body, auth=sender or OdooFinAuth(record=self.link_account.sudo()), timeout=10)
+
+    def get_jobs(self):
+        return self.env['account.online.sync.job'].search([('account_online_link_id', '=', self.link_account.id)])
+
+    def test_notification(self):
+        response = self.notify({'account_ids': ['A']})
+        self.assertEqual(response.status_code, 200)
+        self.assertRecordValues(self.get_jobs(), [{
+            'state': 'pending',
+            'refresh': False,
+            'show_transactions': False,
+            'account_online_account_ids': self.online_accounts[0].ids,
+        }])
+
+    def test_notification_user(self):
+        # The synchronization runs as the last user who synchronized the link
+        self.env['account.online.sync.job'].create({
+            'account_online_link_id': self.link_account.id,
+            'user_id': self.env.ref('base.user_admin').id,
+            'state': 'done',
+        })
+        self.assertEqual(self.notify({'account_ids': ['A']}).status_code, 200)
+        self.assertEqual(self.get_jobs().filtered(lambda j: j.state == 'pending').user_id, self.env.ref('base.user_admin'))
+
+    def test_notification_burst(self):
+        for account_ids in (['A'], ['A', 'B'], ['B']):
+            self.assertEqual(self.notify({'account_ids': account_ids}).status_code, 200)
+        # The notifications are coalesced into one synchronization
+        self.assertRecordValues(self.get_jobs(), [{'state': 'pending', 'account_online_account_ids': self.online_accounts.ids}])
+
+    def test_notification_invalid_signature(self):
+        sender = OdooFinAuth()
+        sender.client_id = 'test_client'
+        sender.access_token = 'test_access_token'
+        sender.refresh_token = base64.b64encode(b'wrong_refresh_token').decode()
+        self.assertEqual(self.notify({'account_ids': ['A']}, sender=sender).status_code, 403)
+        self.assertFalse(self.get_jobs())
+
+    def test_notification_replay(self):
+        url = 'http://%s:%s/account_online_synchronization/notification' % (odoo.tests.HOST, odoo.tools.config['http_port'])
+        request = self.opener.prepare_request(requests.Request(
+            'POST', url, json={'account_ids': ['A']}, auth=OdooFinAuth(record=self.link_account.sudo())))
+        self.assertEqual(self.opener.send(request, timeout=10).status_code, 200)
+        # The same notification sent again is refused, even within its validity
+        self.assertEqual(self.opener.send(request, timeout=10).status_code, 403)
+        self.assertEqual(len(self.get_jobs()), 1)
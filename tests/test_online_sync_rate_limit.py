@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from contextlib import contextmanager
+from psycopg2 import IntegrityError
+from unittest.mock import patch
+
+from odoo.addons.account_online_synchronization.models import account_online_rate_limit
+from odoo.tests import tagged, TransactionCase
+from odoo.tools import mute_logger
+
+
+@tagged('post_install', '-at_install')
+class TestSynchRateLimit(TransactionCase):
+    def setUp(self):
+        super(TestSynchRateLimit, self).setUp()
+        self.RateLimit = self.env['account.online.rate.limit']
+        self.limit = self.RateLimit.create({'proxy_mode': 'test', 'rate': 0.1, 'burst': 2})
+        self.waits = []
+        patcher = patch.object(account_online_rate_limit.time, 'sleep', self.waits.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # The limits of the test are not visible from another cursor
+        @contextmanager
+        def _bucket_cursor(rate_limit):
+            yield self.env.cr
+
+        patcher = patch.object(type(self.RateLimit), '_bucket_cursor', _bucket_cursor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_exhaustion(self):
+        # The burst goes through at once, the next call waits for a token to be refilled
+        self.RateLimit._acquire('test', 'Test Bank')
+        self.RateLimit._acquire('test', 'Test Bank')
+        self.assertFalse(self.waits)
+        self.RateLimit._acquire('test', 'Test Bank')
+        self.assertEqual(len(self.waits), 1)
+        self.assertAlmostEqual(self.waits[0], 10.0, delta=0.5)
+        self.limit.invalidate_cache()
+        self.assertLess(self.limit.tokens, 0)
+
+    def test_refill(self):
+        self.RateLimit._acquire('test')
+        self.env.cr.execute("UPDATE account_online_rate_limit SET tokens = -1, last_refill = last_refill - 100 WHERE id = %s", [self.limit.id])
+        # The bucket is refilled at the configured rate, up to the burst
+        self.RateLimit._acquire('test')
+        self.assertFalse(self.waits)
+        self.limit.invalidate_cache()
+        self.assertAlmostEqual(self.limit.tokens, 1.0, delta=0.01)
+
+    def test_wait_for_slowest_bucket(self):
+        self.RateLimit.create({'proxy_mode': 'test', 'institution': 'Test Bank', 'rate': 0.5, 'burst': 1})
+        self.RateLimit._acquire('test', 'Test Bank')
+        self.assertFalse(self.waits)
+        self.RateLimit._acquire('test', 'Test Bank')
+        # The proxy still has a token, the institution one is refilled in two seconds
+        self.assertEqual(len(self.waits), 1)
+        self.assertAlmostEqual(self.waits[0], 2.0, delta=0.1)
+        # The calls to other institutions are only limited by the proxy one
+        self.RateLimit._acquire('test', 'Other Bank')
+        self.assertEqual(len(self.waits), 2)
+        self.assertAlmostEqual(self.waits[1], 10.0, delta=0.5)
+
+    def test_unique_limit(self):
+        with mute_logger('odoo.sql_db'), self.assertRaises(IntegrityError), self.env.cr.savepoint():
+            self.RateLimit.create({'proxy_mode': 'test', 'rate': 1.0, 'burst': 1})